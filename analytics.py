@@ -0,0 +1,327 @@
+from collections import OrderedDict
+
+from money import fromMinor
+
+class Analytics:
+    def __init__(self, dbHandler):
+        self.db = dbHandler
+
+    def filters(self, account_ids=None, date_from=None, date_to=None, spending=False, category=None):
+        conditions = []
+        params = []
+
+        if account_ids:
+            account_ids = [account_ids] if isinstance(account_ids, str) else list(account_ids)
+            conditions.append(f"account_id IN ({','.join('?' * len(account_ids))})")
+            params += account_ids
+        if date_from:
+            conditions.append("timestamp >= ?")
+            params.append(str(date_from))
+        if date_to:
+            conditions.append("timestamp <= ?")
+            params.append(str(date_to))
+        if spending:
+            conditions.append("amount < 0")
+        if category:
+            conditions.append("classification_id IS ?")
+            params.append(self.db.classificationIds.get(category, -1))
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return where, params
+
+    def query(self, sql, params, money=()):
+        # Pooled read connection so reports can run alongside a sync
+        with self.db.reader() as con:
+            rows = con.execute(sql, params).fetchall()
+
+        if not money:
+            return rows
+
+        # Sums are exact integers in SQLite, the last column is the currency to scale them by
+        out = []
+        for row in rows:
+            row = list(row)
+            for i in money:
+                row[i] = fromMinor(row[i], row[-1])
+            out.append(tuple(row))
+        return out
+
+    def monthlyTotals(self, account_ids=None, date_from=None, date_to=None, category=None):
+        where, params = self.filters(account_ids, date_from, date_to, category=category)
+
+        return self.query(
+            f'''
+            SELECT
+                substr(timestamp, 1, 7) AS month,
+                SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END),
+                -SUM(CASE WHEN amount < 0 THEN amount ELSE 0 END),
+                SUM(amount),
+                currency
+            FROM transactions
+            {where}
+            GROUP BY month, currency
+            ORDER BY month, currency
+            ''',
+            params,
+            money=(1, 2, 3)
+        )
+
+    def categoryTotals(self, account_ids=None, date_from=None, date_to=None, sub=False, monthly=False):
+        where, params = self.filters(account_ids, date_from, date_to, spending=True)
+
+        # Grouped on the integer ids, names are filled in from the handler's lookup
+        groups = ["classification_id"]
+        if sub:
+            groups.append("sub_classification_id")
+        if monthly:
+            groups.insert(0, "substr(timestamp, 1, 7)")
+
+        # Minor units only add up within one currency
+        keys = groups + ["currency"]
+
+        rows = self.query(
+            f'''
+            SELECT
+                {', '.join(groups)},
+                -SUM(amount) AS total,
+                COUNT(*),
+                currency
+            FROM transactions
+            {where}
+            GROUP BY {', '.join(keys)}
+            ORDER BY {'1, ' if monthly else ''}currency, total DESC
+            ''',
+            params,
+            money=(len(groups),)
+        )
+
+        names = self.db.classificationNames
+        subNames = self.db.subClassificationNames
+        start = 1 if monthly else 0
+        out = []
+        for row in rows:
+            row = list(row)
+            row[start] = names.get(row[start])
+            if sub:
+                row[start + 1] = subNames.get(row[start + 1])
+            out.append(tuple(row))
+        return out
+
+    def topMerchants(self, n=10, account_ids=None, date_from=None, date_to=None, category=None):
+        where, params = self.filters(account_ids, date_from, date_to, spending=True, category=category)
+        where += " AND merchant_name IS NOT NULL" if where else "WHERE merchant_name IS NOT NULL"
+
+        # Totals in different currencies can't be ranked together, so it's the top n of each
+        return self.query(
+            f'''
+            SELECT merchant_name, total, count, currency
+            FROM (
+                SELECT
+                    merchant_name,
+                    -SUM(amount) AS total,
+                    COUNT(*) AS count,
+                    currency,
+                    ROW_NUMBER() OVER (PARTITION BY currency ORDER BY -SUM(amount) DESC) AS rank
+                FROM transactions
+                {where}
+                GROUP BY merchant_name, currency
+            )
+            WHERE rank <= ?
+            ORDER BY currency, total DESC
+            ''',
+            params + [n],
+            money=(1,)
+        )
+
+    def rollingSpending(self, months=3, account_ids=None, date_from=None, date_to=None):
+        where, params = self.filters(account_ids, date_from, date_to, spending=True)
+
+        return self.query(
+            f'''
+            SELECT
+                month,
+                spending,
+                AVG(spending) OVER (
+                    PARTITION BY currency
+                    ORDER BY month
+                    ROWS BETWEEN ? PRECEDING AND CURRENT ROW
+                ),
+                currency
+            FROM (
+                SELECT
+                    substr(timestamp, 1, 7) AS month,
+                    -SUM(amount) AS spending,
+                    currency
+                FROM transactions
+                {where}
+                GROUP BY month, currency
+            )
+            ORDER BY month, currency
+            ''',
+            [months - 1] + params,
+            money=(1, 2)
+        )
+
+def categoryTotalsDelta(row, sign):
+    return f'''
+        INSERT INTO category_totals (account_id, month, category, total, count)
+        VALUES (
+            {row}.account_id,
+            substr({row}.timestamp, 1, 7),
+            COALESCE((SELECT name FROM classifications WHERE id = {row}.classification_id), ''),
+            {sign}{row}.amount,
+            {sign}1
+        )
+        ON CONFLICT (account_id, month, category) DO UPDATE SET
+        total = total + excluded.total,
+        count = count + excluded.count;
+    '''
+
+CATEGORY_TOTALS_TRIGGERS = [
+    f'''
+    CREATE TRIGGER category_totals_insert AFTER INSERT ON transactions BEGIN
+        {categoryTotalsDelta('NEW', '')}
+    END;
+    ''',
+    f'''
+    CREATE TRIGGER category_totals_delete AFTER DELETE ON transactions BEGIN
+        {categoryTotalsDelta('OLD', '-')}
+    END;
+    ''',
+    f'''
+    CREATE TRIGGER category_totals_update
+    AFTER UPDATE OF account_id, timestamp, amount, classification_id ON transactions BEGIN
+        {categoryTotalsDelta('OLD', '-')}
+        {categoryTotalsDelta('NEW', '')}
+    END;
+    ''',
+]
+
+# Totals are kept in integer minor units so deltas never drift
+class AggregateCache:
+    def __init__(self, dbHandler, max_entries=10000, persistent=False):
+        self.db = dbHandler
+        self.max_entries = max_entries
+        self.persistent = persistent
+        self.entries = OrderedDict()
+        self.dataVersion = None
+
+        if persistent:
+            self.createTable()
+
+        # Ingest and edits push deltas instead of invalidating
+        self.db.observers.append(self)
+
+    def createTable(self):
+        cursor = self.db.con.cursor()
+        if cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'category_totals_insert'"
+        ).fetchone():
+            return
+
+        # Built once with its triggers, so every writer keeps it current, attached cache or not
+        try:
+            cursor.execute("DROP TABLE IF EXISTS category_totals")
+            cursor.execute(
+                '''
+                CREATE TABLE `category_totals` (
+                    `account_id` VARCHAR(32) NOT NULL,
+                    `month` VARCHAR(7) NOT NULL,
+                    `category` VARCHAR(64) NOT NULL,
+                    `total` INTEGER NOT NULL,
+                    `count` INT NOT NULL,
+                    PRIMARY KEY (`account_id`, `month`, `category`)
+                );
+                '''
+            )
+
+            # Uncategorised rows are stored under '' so they take part in the primary key
+            cursor.execute(
+                '''
+                INSERT INTO category_totals
+                SELECT
+                    account_id,
+                    substr(timestamp, 1, 7),
+                    COALESCE(c.name, ''),
+                    SUM(amount),
+                    COUNT(*)
+                FROM transactions
+                LEFT JOIN classifications AS c ON c.id = transactions.classification_id
+                GROUP BY 1, 2, 3
+                '''
+            )
+
+            for trigger in CATEGORY_TOTALS_TRIGGERS:
+                cursor.execute(trigger)
+        except Exception:
+            self.db.con.rollback()
+            raise
+
+        self.db.con.commit()
+
+    def category(self, classification):
+        return classification[0] if classification else None
+
+    def get(self, account_id, month, category):
+        # data_version moves when another connection commits, their writes never reach the observers
+        dataVersion = self.db.con.execute("PRAGMA data_version").fetchone()[0]
+        if dataVersion != self.dataVersion:
+            self.entries.clear()
+            self.dataVersion = dataVersion
+
+        key = (account_id, month, category)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return tuple(self.entries[key])
+
+        value = self.load(account_id, month, category)
+        self.entries[key] = list(value)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+        return value
+
+    def load(self, account_id, month, category):
+        with self.db.reader() as con:
+            if self.persistent:
+                row = con.execute(
+                    '''
+                    SELECT total, count FROM category_totals
+                    WHERE account_id = ? AND month = ? AND category = ?
+                    ''',
+                    (account_id, month, category or '')
+                ).fetchone()
+                return tuple(row) if row else (0, 0)
+
+            classification_id = self.db.classificationIds.get(category, -1) if category else None
+            row = con.execute(
+                '''
+                SELECT COALESCE(SUM(amount), 0), COUNT(*)
+                FROM transactions
+                WHERE account_id = ?
+                AND timestamp BETWEEN ? AND ?
+                AND classification_id IS ?
+                ''',
+                (account_id, f"{month}-01", f"{month}-31", classification_id)
+            ).fetchone()
+            return tuple(row)
+
+    def apply(self, account_id, timestamp, category, amount, count):
+        key = (account_id, timestamp[:7], category)
+        if key in self.entries:
+            self.entries[key][0] += amount
+            self.entries[key][1] += count
+
+    def transactionsInserted(self, rows):
+        for _, account_id, timestamp, amount, classification in rows:
+            self.apply(account_id, timestamp, self.category(classification), amount, 1)
+
+    def transactionUpdated(self, old, classification):
+        _, account_id, timestamp, amount, oldClassification = old
+        before = self.category(oldClassification)
+        after = self.category(classification)
+        if before == after:
+            return
+
+        self.apply(account_id, timestamp, before, -amount, -1)
+        self.apply(account_id, timestamp, after, amount, 1)
@@ -0,0 +1,35 @@
+import argparse
+
+from common import ACCOUNTS, DatabaseHandler, finish, ledgerDatabase, report, timed
+
+from analytics import Analytics
+
+# Each aggregate over the whole synthetic ledger, the request's target is under a second
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    db = DatabaseHandler(ledgerDatabase(args.rows))
+    analytics = Analytics(db)
+    queries = {
+        'monthlyTotals': lambda: analytics.monthlyTotals(),
+        'categoryTotals': lambda: analytics.categoryTotals(),
+        'categoryTotals sub monthly': lambda: analytics.categoryTotals(sub=True, monthly=True),
+        'topMerchants': lambda: analytics.topMerchants(5),
+        'rollingSpending': lambda: analytics.rollingSpending(3, ACCOUNTS[:2]),
+    }
+
+    results = []
+    try:
+        for name, query in queries.items():
+            seconds, rows = timed(query, args.repeat)
+            results.append(report(f"{name} ({len(rows)} rows)", seconds, "s", 1))
+    finally:
+        db.close()
+
+    finish(results)
+
+if __name__ == '__main__':
+    main()
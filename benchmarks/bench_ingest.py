@@ -0,0 +1,102 @@
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from common import DatabaseHandler, finish, report, syntheticTransactions, timed
+
+# Bulk insertTransactions against the original ingest: a plain connection with default pragmas,
+# one INSERT and one commit per row
+BASELINE_TABLE = '''
+    CREATE TABLE `transactions` (
+        `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+        `normalised_id` VARCHAR(128),
+        `account_id` VARCHAR(32) NOT NULL,
+        `timestamp` DATE NOT NULL,
+        `amount` DECIMAL NOT NULL,
+        `currency` VARCHAR(4) NOT NULL,
+        `merchant_name` VARCHAR(128),
+        `description` TEXT,
+        `type` VARCHAR(10) NOT NULL,
+        `category` VARCHAR(64),
+        `classification` TEXT,
+        `balance_amount` DECIMAL,
+        `balance_currency` VARCHAR(4),
+        `unstructured` TEXT
+    );
+'''
+
+BASELINE_INSERT = '''
+    INSERT INTO transactions (
+        normalised_id,
+        account_id,
+        timestamp,
+        amount,
+        currency,
+        merchant_name,
+        description,
+        type,
+        category,
+        classification,
+        balance_amount,
+        balance_currency
+    )
+    VALUES (
+        ?,?,?,?,?,?,?,?,?,?,?,?
+    )
+'''
+
+def insertRows(con, transactions):
+    for t in transactions:
+        running_balance = t.get('running_balance')
+        con.execute(BASELINE_INSERT, (
+            t['normalised_provider_transaction_id'],
+            'a',
+            t['timestamp'][:10],
+            t['amount'],
+            t['currency'],
+            t.get('merchant_name'),
+            t['description'],
+            t['transaction_type'],
+            t['transaction_category'],
+            json.dumps(t['transaction_classification']),
+            running_balance['amount'] if running_balance else None,
+            running_balance['currency'] if running_balance else None,
+        ))
+        con.commit()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--sample', type=int, default=2000)
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp()
+    try:
+        # The per-row path fsyncs every row, so it is timed on a sample
+        con = sqlite3.connect(os.path.join(work, "rows.db"))
+        con.execute(BASELINE_TABLE)
+        transactions = list(syntheticTransactions(args.sample, prefix='r'))
+        seconds, _ = timed(lambda: insertRows(con, transactions))
+        perRow = args.sample / seconds
+        con.close()
+        print(f"per-row baseline: {perRow:,.0f} rows/s")
+
+        db = DatabaseHandler(os.path.join(work, "bulk.db"))
+        transactions = list(syntheticTransactions(args.rows))
+        seconds, inserted = timed(lambda: db.insertTransactions('a', transactions))
+        bulk = inserted / seconds
+        db.close()
+        print(f"insertTransactions: {bulk:,.0f} rows/s")
+    finally:
+        shutil.rmtree(work)
+
+    finish([
+        report("bulk insert", bulk, "rows/s", 20000, higher=True),
+        report("bulk vs per-row", bulk / perRow, "x", 20, higher=True),
+    ])
+
+if __name__ == '__main__':
+    main()
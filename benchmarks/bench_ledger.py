@@ -0,0 +1,55 @@
+import argparse
+import os
+import shutil
+import tempfile
+import tracemalloc
+
+from common import DatabaseHandler, finish, ledgerDatabase, report, syntheticTransactions, timed
+
+import ledger
+
+# Export and import throughput for the Parquet/Arrow ledger, against inserting row by row
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--sample', type=int, default=2000)
+    args = parser.parse_args()
+
+    source = DatabaseHandler(ledgerDatabase(args.rows))
+    work = tempfile.mkdtemp()
+    results = []
+
+    try:
+        baseline = DatabaseHandler(os.path.join(work, "rows.db"))
+        transactions = list(syntheticTransactions(args.sample, prefix='r'))
+        seconds, _ = timed(lambda: [baseline.insertTransaction(account_id='a', **t) for t in transactions])
+        perRow = args.sample / seconds
+        baseline.close()
+        print(f"insertTransaction row by row: {perRow:,.0f} rows/s")
+
+        for format in ledger.FORMATS:
+            directory = os.path.join(work, format)
+
+            seconds, counts = timed(lambda: ledger.exportLedger(source, directory, format))
+            rows = counts['transactions']
+            results.append(report(f"{format} export", rows / seconds, "rows/s", 100000, higher=True))
+
+            # Python side peak, bounded by one fetchmany batch whatever the ledger size
+            tracemalloc.start()
+            ledger.exportLedger(source, directory, format)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results.append(report(f"{format} export peak memory", peak / 2 ** 20, "MB", 128))
+
+            target = DatabaseHandler(os.path.join(work, f"{format}.db"))
+            seconds, _ = timed(lambda: ledger.importLedger(target, directory, format))
+            target.close()
+            results.append(report(f"{format} import vs row by row", rows / seconds / perRow, "x", 10, higher=True))
+    finally:
+        source.close()
+        shutil.rmtree(work)
+
+    finish(results)
+
+if __name__ == '__main__':
+    main()
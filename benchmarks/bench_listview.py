@@ -0,0 +1,98 @@
+import argparse
+import os
+import time
+import tracemalloc
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from common import DatabaseHandler, finish, ledgerDatabase, report
+
+from PyQt5 import QtCore, QtWidgets
+
+from listTest import Categorised, ROW_COLUMNS, TransactionDelegate, TransactionModel, Uncategorised
+
+# Time to first paint and row memory of the paged model against one widget per row
+class PaintWatcher(QtCore.QObject):
+    def __init__(self):
+        super().__init__()
+        self.painted = False
+
+    def eventFilter(self, watched, event):
+        if event.type() == QtCore.QEvent.Paint:
+            self.painted = True
+        return False
+
+def firstPaint(app, view):
+    watcher = PaintWatcher()
+    view.viewport().installEventFilter(watcher)
+    view.show()
+    while not watcher.painted:
+        app.processEvents()
+    view.viewport().removeEventFilter(watcher)
+
+def widgetList(app, transactions):
+    # The old MainWindow: a live widget per row attached with setItemWidget
+    start = time.perf_counter()
+    view = QtWidgets.QListWidget()
+    for transaction in transactions:
+        widget = Categorised() if transaction['merchant_name'] else Uncategorised()
+        widget.setTransaction(transaction)
+        item = QtWidgets.QListWidgetItem(view)
+        item.setSizeHint(widget.sizeHint())
+        view.setItemWidget(item, widget)
+    firstPaint(app, view)
+    seconds = time.perf_counter() - start
+    view.close()
+    return seconds
+
+def modelView(app, db, account_id):
+    start = time.perf_counter()
+    view = QtWidgets.QListView()
+    view.setUniformItemSizes(True)
+    view.setModel(TransactionModel(db, account_id))
+    view.setItemDelegate(TransactionDelegate(view))
+    firstPaint(app, view)
+    return time.perf_counter() - start, view
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--sample', type=int, default=2000)
+    args = parser.parse_args()
+
+    app = QtWidgets.QApplication([])
+    db = DatabaseHandler(ledgerDatabase(args.rows * 4))
+    account_id = 'a'
+
+    try:
+        seconds, view = modelView(app, db, account_id)
+        print(f"model first paint: {seconds * 1e3:.1f} ms")
+
+        # Scrolling to the bottom until every row has been fetched
+        model = view.model()
+        tracemalloc.start()
+        while model.canFetchMore(QtCore.QModelIndex()):
+            model.fetchMore(QtCore.QModelIndex())
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        view.scrollToBottom()
+        app.processEvents()
+        print(f"model holds {model.rowCount()} rows in {memory / 2 ** 20:.1f} MB")
+
+        # Widgets are built for a sample, the full list would take minutes
+        transactions = [dict(zip(ROW_COLUMNS, row)) for row in model.rows[:args.sample]]
+        widgetSeconds = widgetList(app, transactions)
+        estimate = widgetSeconds * model.rowCount() / len(transactions)
+        print(f"widget list first paint: {widgetSeconds:.2f}s for {len(transactions)} rows, about {estimate:.0f}s for {model.rowCount()}")
+        view.close()
+    finally:
+        db.close()
+
+    finish([
+        report("model first paint", seconds * 1e3, "ms", 100),
+        report(f"model row store for {model.rowCount()} rows", memory / 2 ** 20, "MB", 64),
+        report("first paint vs widget list", estimate / seconds, "x", 100, higher=True),
+    ])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+import argparse
+import os
+import random
+import shutil
+import tempfile
+from datetime import date, timedelta
+
+from common import ACCOUNTS, DatabaseHandler, finish, ledgerDatabase, report, timed
+
+from money import fromMinor
+
+# 10k pending items across the accounts of the 1M-row ledger, half of them already settled
+def pendingFor(db, account_id, count, rng):
+    settled = db.cursor.execute(
+        '''
+        SELECT timestamp, amount, currency, merchant_name FROM transactions
+        WHERE account_id = ? ORDER BY random() LIMIT ?
+        ''',
+        (account_id, count // 2)
+    ).fetchall()
+
+    # Settled items post a day or two after the pending one, without sharing its id
+    pending = [
+        {
+            'transaction_id': f"p{account_id}{i}",
+            'timestamp': str(date.fromisoformat(timestamp) - timedelta(days=rng.randint(0, 2))),
+            'amount': fromMinor(amount, currency),
+            'currency': currency,
+            'merchant_name': merchant_name,
+            'description': 'card payment',
+            'transaction_type': 'DEBIT',
+            'transaction_category': 'PURCHASE',
+            'transaction_classification': [],
+        }
+        for i, (timestamp, amount, currency, merchant_name) in enumerate(settled)
+    ]
+    pending += [
+        {
+            'transaction_id': f"q{account_id}{i}",
+            'timestamp': '2030-01-01',
+            'amount': -rng.randint(1, 10000) / 100,
+            'currency': 'GBP',
+            'merchant_name': None,
+            'description': 'card payment',
+            'transaction_type': 'DEBIT',
+            'transaction_category': 'PURCHASE',
+            'transaction_classification': [],
+        }
+        for i in range(count - len(pending))
+    ]
+    return pending
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--pending', type=int, default=10000)
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp()
+    path = os.path.join(work, "pending.db")
+    shutil.copy(ledgerDatabase(args.rows), path)
+    db = DatabaseHandler(path)
+    rng = random.Random(21)
+
+    try:
+        pending = {
+            account_id: pendingFor(db, account_id, args.pending // len(ACCOUNTS), rng)
+            for account_id in ACCOUNTS
+        }
+
+        def replace():
+            return sum(db.replacePendingTransactions(account_id, items) for account_id, items in pending.items())
+
+        seconds, unmatched = timed(replace)
+        print(f"{args.pending} pending, {args.pending - unmatched} matched to settled rows")
+        first = report("first reconcile", seconds, "s", 1)
+
+        # Every sync replaces the full list, so the repeat is the steady state
+        seconds, _ = timed(replace)
+        repeat = report("repeat reconcile", seconds, "s", 1)
+    finally:
+        db.close()
+        shutil.rmtree(work)
+
+    finish([first, repeat])
+
+if __name__ == '__main__':
+    main()
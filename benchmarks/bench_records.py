@@ -0,0 +1,77 @@
+import argparse
+import gc
+import time
+import tracemalloc
+
+from common import ACCOUNTS, DatabaseHandler, finish, ledgerDatabase, report
+
+from money import fromMinor
+
+# Reading the whole ledger as records, against building a dict per row from cursor.description
+def dicts(db):
+    cursor = db.con.cursor()
+    res = cursor.execute(
+        f'''
+        SELECT * FROM transactions
+        WHERE account_id IN ({','.join('?' * len(ACCOUNTS))})
+        ORDER BY timestamp, id
+        ''',
+        ACCOUNTS
+    )
+    keys = [column[0] for column in cursor.description]
+
+    out = []
+    for row in res:
+        transaction = dict(zip(keys, row))
+        transaction['amount'] = fromMinor(transaction['amount'], transaction['currency'])
+        transaction['classification'] = db.classificationFromIds(
+            transaction.pop('classification_id'),
+            transaction.pop('sub_classification_id')
+        )
+        out.append(transaction)
+    return out
+
+def records(db):
+    return db.getTransactions(ACCOUNTS)
+
+def measure(read, db):
+    gc.collect()
+    start = time.perf_counter()
+    rows = read(db)
+    seconds = time.perf_counter() - start
+    count = len(rows)
+    del rows
+
+    # Memory is measured on a separate pass, tracing slows the read down
+    gc.collect()
+    tracemalloc.start()
+    rows = read(db)
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del rows
+
+    return count, seconds, retained
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    args = parser.parse_args()
+
+    db = DatabaseHandler(ledgerDatabase(args.rows))
+    try:
+        results = {}
+        for name, read in (("dict per row", dicts), ("records", records)):
+            count, seconds, retained = measure(read, db)
+            results[name] = (seconds, retained)
+            print(f"{name}: {count} rows, {count / seconds:,.0f} rows/s, {retained / 2 ** 20:.0f} MB retained")
+    finally:
+        db.close()
+
+    before, after = results["dict per row"], results["records"]
+    finish([
+        report("throughput vs dict per row", before[0] / after[0], "x", 1.1, higher=True),
+        report("memory vs dict per row", after[1] / before[1], "x", 0.8),
+    ])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+import argparse
+import os
+import shutil
+import tempfile
+
+from common import DatabaseHandler, finish, ledgerDatabase, report, syntheticTransactions, timed
+
+from rules import RulesEngine
+
+# 500 merchant rules applied over the whole ledger, and to a batch at ingest
+RULES = [
+    ('exact', 'tesco', 'Shopping', 'Groceries'),
+    ('prefix', 'spot', 'Entertainment', 'Music'),
+    ('regex', r'al+di', 'Shopping', 'Groceries'),
+    ('regex', r'^pret\b', 'Food & Dining', 'Coffee shops'),
+]
+
+def rules(count):
+    kinds = ('exact', 'prefix', 'regex')
+    filler = [
+        (kinds[i % 3], f"shop {i}" if i % 3 != 2 else rf"shop{i}\d+", 'Shopping', 'Clothing')
+        for i in range(count - len(RULES))
+    ]
+    return filler + RULES
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--rules', type=int, default=500)
+    parser.add_argument('--batch', type=int, default=100000)
+    args = parser.parse_args()
+
+    # History is rewritten, so the cached ledger is copied first
+    work = tempfile.mkdtemp()
+    path = os.path.join(work, "rules.db")
+    shutil.copy(ledgerDatabase(args.rows), path)
+    db = DatabaseHandler(path)
+
+    try:
+        engine = RulesEngine(db)
+        seconds, _ = timed(lambda: engine.addRules(rules(args.rules)))
+        print(f"added {args.rules} rules in {seconds:.2f}s")
+
+        seconds, updated = timed(lambda: engine.applyToHistory(overwrite=True))
+        history = report(f"applyToHistory over {args.rows} rows ({updated} updated)", seconds, "s", 10)
+
+        # Rows the provider already classified are skipped, so the batch is left unclassified
+        transactions = list(syntheticTransactions(args.batch, prefix='n'))
+        for transaction in transactions:
+            transaction['transaction_classification'] = []
+        seconds, _ = timed(lambda: engine.applyToTransactions(transactions))
+        ingest = report(f"applyToTransactions on {args.batch} rows", args.batch / seconds, "rows/s", 200000, higher=True)
+    finally:
+        db.close()
+        shutil.rmtree(work)
+
+    finish([history, ingest])
+
+if __name__ == '__main__':
+    main()
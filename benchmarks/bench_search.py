@@ -0,0 +1,32 @@
+import argparse
+
+from common import DatabaseHandler, finish, ledgerDatabase, report, timed
+
+# First page of full-text search over the 1M-row ledger, the request's target is under 50 ms
+QUERIES = {
+    'merchant and number': ('tesco 417', {}),
+    'prefix': ('pre man 41', {}),
+    'account and date filtered': ('spot', {'account_ids': ['a'], 'date_from': '2022-06-01', 'date_to': '2022-06-30'}),
+    'amount filtered': ('amazon 9', {'max_amount': -90}),
+    'no match': ('zebra', {}),
+}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    db = DatabaseHandler(ledgerDatabase(args.rows))
+    results = []
+    try:
+        for name, (query, filters) in QUERIES.items():
+            seconds, page = timed(lambda: db.searchTransactions(query, **filters), args.repeat)
+            results.append(report(f"{name} '{query}' ({len(page)} results)", seconds * 1e3, "ms", 50))
+    finally:
+        db.close()
+
+    finish(results)
+
+if __name__ == '__main__':
+    main()
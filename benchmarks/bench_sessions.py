@@ -0,0 +1,145 @@
+import argparse
+import json
+import os
+import shutil
+import ssl
+import subprocess
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from common import DatabaseHandler, finish, report, timed
+
+from datamarshal import DataMarshaller
+from truelayer import TrueLayerHandler, createSession
+
+# Connections and per-request latency for loadTLHandlers -> addAccounts -> refreshOverdraft,
+# against a local HTTPS stub, with the shared pooled session and with a connection per request
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate writes, Nagle would hold the body for a delayed ACK
+    disable_nagle_algorithm = True
+    accounts = 10
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, data):
+        with self.server.lock:
+            self.server.requests += 1
+
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.respond({'access_token': 'access', 'refresh_token': 'refresh', 'expires_in': 3600})
+
+    def do_GET(self):
+        if self.path.endswith("/balance"):
+            self.respond({'results': [{'overdraft': 250.0}]})
+            return
+
+        with self.server.lock:
+            self.server.lists += 1
+            link = self.server.lists
+
+        self.respond({'results': [
+            {
+                'account_id': f"{link}-{i}",
+                'account_type': 'TRANSACTION',
+                'display_name': f"Account {i}",
+                'currency': 'GBP',
+                'account_number': {'number': '12345678', 'sort_code': '00-00-00'},
+            }
+            for i in range(self.accounts)
+        ]})
+
+class UnpooledSession:
+    # What the handlers did before sessions were shared, a module level requests call per request
+    def __init__(self, verify):
+        self.verify = verify
+
+    def get(self, url, **kwargs):
+        return requests.get(url, verify=self.verify, **kwargs)
+
+    def post(self, url, **kwargs):
+        return requests.post(url, verify=self.verify, **kwargs)
+
+def certificate(directory):
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost",
+         "-keyout", key, "-out", cert],
+        check=True, capture_output=True
+    )
+    return cert, key
+
+def cycle(server, work, session, links):
+    server.connections = server.requests = 0
+    server.lists = getattr(server, 'lists', 0)
+
+    db = DatabaseHandler(os.path.join(work, f"{id(session)}.db"))
+    for link in range(links):
+        db.addRefreshToken(f"refresh-{link}")
+
+    marshaller = DataMarshaller(db, ip='127.0.0.1', session=session)
+    seconds, _ = timed(lambda: [marshaller.addAccounts(link) for link in range(1, links + 1)])
+    db.close()
+
+    return server.connections, server.requests, seconds
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--links', type=int, default=5)
+    parser.add_argument('--accounts', type=int, default=10)
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp()
+    cert, key = certificate(work)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+
+    StubHandler.accounts = args.accounts
+    server = ThreadingHTTPServer(("localhost", 0), StubHandler)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    base = f"https://localhost:{server.server_address[1]}"
+    TrueLayerHandler.base_url = base
+    TrueLayerHandler.auth_url = f"{base}/connect/token"
+
+    try:
+        pooled = createSession()
+        pooled.verify = cert
+        pooled.trust_env = False
+        results = {}
+        for name, session in (("per request", UnpooledSession(cert)), ("pooled", pooled)):
+            connections, count, seconds = cycle(server, work, session, args.links)
+            results[name] = (connections, seconds / count)
+            print(f"{name}: {count} requests, {connections} connections, {seconds / count * 1e3:.2f} ms per request")
+    finally:
+        server.shutdown()
+        shutil.rmtree(work)
+
+    finish([
+        report("pooled connections", results["pooled"][0], "connections", 1),
+        report("per-request latency saved", results["per request"][1] / results["pooled"][1], "x", 2, higher=True),
+    ])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import argparse
+import os
+import shutil
+import tempfile
+
+from common import DatabaseHandler, finish, report, timed
+
+from datamarshal import DataMarshaller
+
+# Cold start of DatabaseHandler plus DataMarshaller with many stored links
+class NoNetworkSession:
+    def __init__(self):
+        self.requests = 0
+
+    def get(self, *args, **kwargs):
+        self.requests += 1
+        raise RuntimeError("Startup made a network request")
+
+    post = get
+
+def build(path, links, accounts):
+    db = DatabaseHandler(path)
+    for link in range(links):
+        link_id = db.addRefreshToken(f"refresh-{link}")
+        db.cursor.executemany(
+            "INSERT INTO accounts VALUES (?, ?, 'TRANSACTION', 'Current', 0, 'GBP', '12345678', '00-00-00', 0)",
+            [(f"{link}-{i}", link_id) for i in range(accounts)]
+        )
+        db.cursor.execute(
+            "INSERT INTO cards VALUES (?, ?, 'CREDIT', 'Card', 0, NULL, 'GBP', '1234', 0)",
+            (f"{link}-card", link_id)
+        )
+    db.con.commit()
+    db.close()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--links', type=int, default=100)
+    parser.add_argument('--accounts', type=int, default=5)
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp()
+    path = os.path.join(work, "startup.db")
+    build(path, args.links, args.accounts)
+
+    session = NoNetworkSession()
+    statements = []
+    opened = []
+
+    def start():
+        statements.clear()
+        db = DatabaseHandler(path)
+        db.con.set_trace_callback(statements.append)
+        opened.append(db)
+        return DataMarshaller(db, session=session)
+
+    try:
+        # The first open can be slowed by the OS page cache, so the best of several is taken
+        seconds, marshaller = timed(start, repeat=5)
+        loaded = sum(map(len, marshaller.accounts.values())) + sum(map(len, marshaller.cards.values()))
+        print(f"{args.links} links, {loaded} accounts and cards mapped, {len(marshaller.tlHandlers)} handlers built")
+    finally:
+        for db in opened:
+            db.close()
+        shutil.rmtree(work)
+
+    finish([
+        report("cold start", seconds * 1e3, "ms", 50),
+        report("network requests", session.requests, "requests", 0),
+        report("queries after open", len(statements), "queries", 1),
+    ])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+import argparse
+import os
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from common import finish, report, timed
+
+from PyQt5 import QtWidgets, uic
+
+from listTest import Categorised, UI_DIR, Uncategorised
+
+# Row widget construction with the forms parsed once at import, against uic.loadUi per widget
+class ParsedPerRow(QtWidgets.QWidget):
+    def __init__(self, name):
+        super().__init__()
+        uic.loadUi(os.path.join(UI_DIR, name), self)
+
+def construct(rows, factories):
+    widgets = [factories[i % 2]() for i in range(rows)]
+    for widget in widgets:
+        widget.deleteLater()
+    return widgets
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10000)
+    args = parser.parse_args()
+
+    app = QtWidgets.QApplication([])
+
+    perRow, _ = timed(lambda: construct(args.rows, (
+        lambda: ParsedPerRow("categorised.ui"),
+        lambda: ParsedPerRow("uncategorised.ui"),
+    )))
+    app.processEvents()
+    compiled, _ = timed(lambda: construct(args.rows, (Categorised, Uncategorised)))
+    app.processEvents()
+
+    print(f"loadUi per widget: {perRow:.2f}s, {perRow / args.rows * 1e6:.0f} us per widget")
+    print(f"parsed once: {compiled:.2f}s, {compiled / args.rows * 1e6:.0f} us per widget")
+
+    finish([report(f"construction speedup over {args.rows} rows", perRow / compiled, "x", 2, higher=True)])
+
+if __name__ == '__main__':
+    main()
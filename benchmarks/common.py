@@ -0,0 +1,77 @@
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from database import DatabaseHandler
+
+ACCOUNTS = ['a', 'b', 'c', 'd']
+MERCHANTS = ['Tesco', 'Aldi', 'Spotify', 'Pret A Manger', 'Amazon', 'Shell', None]
+CLASSIFICATIONS = [
+    ['Shopping', 'Groceries'],
+    ['Entertainment', 'Music'],
+    ['Bills and Utilities', 'Internet'],
+    ['Auto & Transport', 'Gas & Fuel'],
+    [],
+]
+
+def syntheticTransaction(i, rng, prefix='t'):
+    merchant = rng.choice(MERCHANTS)
+    return {
+        'transaction_id': f"{prefix}{i}",
+        'normalised_provider_transaction_id': f"{prefix}{i}",
+        'timestamp': f"20{18 + i % 5}-{1 + i % 12:02d}-{1 + i % 28:02d}T00:00:00+00:00",
+        'amount': rng.randint(-10000, 5000) / 100,
+        'currency': 'GBP',
+        'merchant_name': merchant,
+        'description': f"{merchant or 'transfer'} {i % 1000}",
+        'transaction_type': 'DEBIT',
+        'transaction_category': 'PURCHASE',
+        'transaction_classification': rng.choice(CLASSIFICATIONS),
+    }
+
+def syntheticTransactions(n, seed=0, prefix='t'):
+    rng = random.Random(seed)
+    return (syntheticTransaction(i, rng, prefix) for i in range(n))
+
+def ledgerDatabase(rows):
+    # Built once per size and reused between runs, a million rows takes a while to insert
+    path = os.path.join(tempfile.gettempdir(), f"ledger-benchmark-{rows}.db")
+    if os.path.exists(path):
+        return path
+
+    building = path + ".building"
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(building + suffix):
+            os.remove(building + suffix)
+
+    print(f"Building a {rows} row database in {path}")
+    db = DatabaseHandler(building)
+    perAccount = rows // len(ACCOUNTS)
+    for n, account_id in enumerate(ACCOUNTS):
+        db.insertTransactions(account_id, syntheticTransactions(perAccount, seed=n, prefix=account_id), chunk_size=5000)
+    db.close()
+
+    os.replace(building, path)
+    return path
+
+def timed(call, repeat=1):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = call()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, result
+
+def report(name, value, unit, target, higher=False):
+    met = value >= target if higher else value <= target
+    print(f"{name}: {value:,.3f} {unit} (target {'>=' if higher else '<='} {target:,} {unit}) {'ok' if met else 'MISSED'}")
+    return met
+
+def finish(results):
+    sys.exit(0 if all(results) else 1)
@@ -0,0 +1,55 @@
+import json
+import os
+from types import MappingProxyType
+
+CATEGORIES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "categories.json")
+
+class CategoryCatalogue:
+    __slots__ = ('categories', 'subCategories', 'categoryIndexes', 'subCategoryIndexes')
+
+    def __init__(self, data):
+        categories = tuple(cat["classification_category"] for cat in data)
+        subCategories = {
+            cat["classification_category"]: tuple(cat["sub_classification_categories"])
+            for cat in data
+        }
+
+        # Positions match the combo boxes, which have a blank entry first
+        object.__setattr__(self, 'categories', categories)
+        object.__setattr__(self, 'subCategories', MappingProxyType(subCategories))
+        object.__setattr__(self, 'categoryIndexes', MappingProxyType(
+            {category: i + 1 for i, category in enumerate(categories)}
+        ))
+        object.__setattr__(self, 'subCategoryIndexes', MappingProxyType({
+            (category, sub): i + 1
+            for category, subs in subCategories.items()
+            for i, sub in enumerate(subs)
+        }))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CategoryCatalogue is immutable")
+
+    @classmethod
+    def load(cls, file=CATEGORIES_FILE):
+        with open(file, "r") as f:
+            return cls(json.load(f))
+
+    def categoryIndex(self, category):
+        return self.categoryIndexes.get(category, 0)
+
+    def subCategoryIndex(self, category, sub):
+        return self.subCategoryIndexes.get((category, sub), 0)
+
+    def isValid(self, classification):
+        if not classification:
+            return True
+        if len(classification) == 1:
+            return classification[0] in self.categoryIndexes
+        return len(classification) == 2 and tuple(classification) in self.subCategoryIndexes
+
+    def validate(self, classification):
+        if not self.isValid(classification):
+            raise ValueError(f"Unknown classification: {classification}")
+        return classification
+
+CATALOGUE = CategoryCatalogue.load()
@@ -1,11 +1,302 @@
 import sqlite3
 import json
+import queue
+import threading
+from contextlib import contextmanager
+from itertools import islice
+from pathlib import Path
+
+from categories import CATALOGUE
+from money import toMinor, fromMinor, minorSql
+from records import Account, Card, Transaction, SearchResult, PendingTransaction, RowFactory
+
+TRANSACTION_COLUMNS = Transaction._fields
+
+# Applied to every connection, journal_mode only matters on the writer
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -32000,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,
+}
+
+# Pending items are replaced on every sync, settled_id points at the row they became
+PENDING_TABLE = '''
+    CREATE TABLE IF NOT EXISTS `pending_transactions` (
+        `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+        `normalised_id` VARCHAR(128),
+        `account_id` VARCHAR(32) NOT NULL,
+        `timestamp` DATE NOT NULL,
+        `amount` INTEGER NOT NULL,
+        `currency` VARCHAR(4) NOT NULL,
+        `merchant_name` VARCHAR(128),
+        `description` TEXT,
+        `type` VARCHAR(10) NOT NULL,
+        `category` VARCHAR(64),
+        `classification_id` INTEGER,
+        `sub_classification_id` INTEGER,
+        `settled_id` INTEGER,
+        FOREIGN KEY (account_id) REFERENCES accounts(account_id),
+        FOREIGN KEY (settled_id) REFERENCES transactions(id)
+    );
+'''
+
+# Each entry upgrades the schema by one version, tracked with PRAGMA user_version
+MIGRATIONS = [
+    [
+        '''
+        DELETE FROM transactions
+        WHERE normalised_id IS NOT NULL
+        AND id NOT IN (
+            SELECT MIN(id) FROM transactions
+            WHERE normalised_id IS NOT NULL
+            GROUP BY account_id, normalised_id
+        );
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS `transactions_account_timestamp`
+        ON `transactions` (`account_id`, `timestamp`, `id`);
+        ''',
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS `transactions_normalised_account`
+        ON `transactions` (`normalised_id`, `account_id`);
+        ''',
+    ],
+    [
+        "ALTER TABLE linked_accounts ADD COLUMN access_token TEXT;",
+        "ALTER TABLE linked_accounts ADD COLUMN expires_at REAL;",
+    ],
+    [
+        "DROP TABLE IF EXISTS cardsBalance;",
+        lambda db: [db.updateBalances(account_id) for account_id in db.getTransactionAccounts()],
+    ],
+    [
+        # Covers the columns aggregate queries read so they never touch the table
+        '''
+        CREATE INDEX IF NOT EXISTS `transactions_account_amount`
+        ON `transactions` (`account_id`, `timestamp`, `amount`);
+        ''',
+    ],
+    [
+        # Full-text index over merchant and description, kept in sync by triggers
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS `transactions_fts` USING fts5(
+            merchant_name,
+            description,
+            content='transactions',
+            content_rowid='id',
+            prefix='2 3'
+        );
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS `transactions_fts_insert` AFTER INSERT ON `transactions` BEGIN
+            INSERT INTO transactions_fts (rowid, merchant_name, description)
+            VALUES (new.id, new.merchant_name, new.description);
+        END;
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS `transactions_fts_delete` AFTER DELETE ON `transactions` BEGIN
+            INSERT INTO transactions_fts (transactions_fts, rowid, merchant_name, description)
+            VALUES ('delete', old.id, old.merchant_name, old.description);
+        END;
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS `transactions_fts_update` AFTER UPDATE OF merchant_name, description ON `transactions` BEGIN
+            INSERT INTO transactions_fts (transactions_fts, rowid, merchant_name, description)
+            VALUES ('delete', old.id, old.merchant_name, old.description);
+            INSERT INTO transactions_fts (rowid, merchant_name, description)
+            VALUES (new.id, new.merchant_name, new.description);
+        END;
+        ''',
+        "INSERT INTO transactions_fts (transactions_fts) VALUES ('rebuild');",
+    ],
+    [
+        # Classifications move from JSON text to ids into the classification tables
+        "ALTER TABLE transactions ADD COLUMN classification_id INTEGER REFERENCES classifications(id);",
+        "ALTER TABLE transactions ADD COLUMN sub_classification_id INTEGER REFERENCES sub_classifications(id);",
+        lambda db: db.migrateClassifications(),
+        '''
+        CREATE INDEX IF NOT EXISTS `transactions_classification`
+        ON `transactions` (`classification_id`, `sub_classification_id`);
+        ''',
+    ],
+    [
+        # The old pending table was never written to
+        "DROP TABLE IF EXISTS pending_transactions;",
+        PENDING_TABLE,
+        '''
+        CREATE INDEX IF NOT EXISTS `transactions_account_amount_timestamp`
+        ON `transactions` (`account_id`, `amount`, `timestamp`);
+        ''',
+    ],
+    [
+        # Money is stored as integer minor units of its currency
+        f"UPDATE transactions SET amount = {minorSql('amount', 'currency')};",
+        f"UPDATE transactions SET balance_amount = {minorSql('balance_amount', 'balance_currency')} WHERE balance_amount IS NOT NULL;",
+        f"UPDATE pending_transactions SET amount = {minorSql('amount', 'currency')};",
+        f"UPDATE daily_balances SET balance = {minorSql('balance', 'currency')};",
+        f"UPDATE accounts SET overdraft = {minorSql('overdraft', 'currency')} WHERE overdraft IS NOT NULL;",
+        f"UPDATE cards SET credit_limit = {minorSql('credit_limit', 'currency')} WHERE credit_limit IS NOT NULL;",
+        # Rebuilt in minor units the next time an AggregateCache is made persistent
+        "DROP TABLE IF EXISTS category_totals;",
+    ],
+]
+
+# Kept as constants so the connection's statement cache sees the same SQL every call
+SELECT_ACCOUNTS = "SELECT * FROM accounts"
+SELECT_LINK_ACCOUNTS = "SELECT * FROM accounts WHERE link_id = ?"
+SELECT_CARDS = "SELECT * FROM cards"
+SELECT_LINK_CARDS = "SELECT * FROM cards WHERE link_id = ?"
+
+SELECT_TRANSACTION = "SELECT * FROM transactions WHERE id = ?"
+SELECT_TRANSACTION_BY_NORMALISED_ID = "SELECT * FROM transactions WHERE normalised_id = ?"
+SELECT_LAST_TRANSACTION = '''
+    SELECT * FROM transactions
+    WHERE account_id = ?
+    ORDER BY timestamp DESC, id DESC LIMIT 1
+'''
+SELECT_TRANSACTION_SUMMARY = '''
+    SELECT id, account_id, timestamp, amount, classification_id, sub_classification_id
+    FROM transactions
+    WHERE id = ?
+'''
+SELECT_INSERTED_SUMMARIES = '''
+    SELECT id, account_id, timestamp, amount, classification_id, sub_classification_id
+    FROM transactions
+    WHERE id > ? AND account_id = ?
+'''
+
+INSERT_TRANSACTION = '''
+    INSERT OR IGNORE INTO transactions (
+        normalised_id,
+        account_id,
+        timestamp,
+        amount,
+        currency,
+        merchant_name,
+        description,
+        type,
+        category,
+        classification_id,
+        sub_classification_id,
+        balance_amount,
+        balance_currency
+    )
+    VALUES (
+        ?,?,?,?,?,?,?,?,?,?,?,?,?
+    )
+'''
+UPDATE_TRANSACTION = '''
+    UPDATE transactions SET
+    merchant_name = ?,
+    classification_id = ?,
+    sub_classification_id = ?,
+    description = ?
+    WHERE id = ?
+    RETURNING *
+'''
+
+def applyPragmas(con, pragmas):
+    for name, value in pragmas.items():
+        if value is not None:
+            con.execute(f"PRAGMA {name} = {value}")
+
+class ReaderPool:
+    def __init__(self, file, size=4, pragmas=None, wait=1.0):
+        self.uri = Path(file).absolute().as_uri() + "?mode=ro"
+        self.size = size
+        self.pragmas = pragmas or {}
+        self.wait = wait
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+        # Pooled connections in use and the thread using them, and temporary ones made past the size
+        self.held = {}
+        self.extra = set()
+
+    def connect(self):
+        # Read-only, and not tied to the thread that opened it
+        con = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+        applyPragmas(con, self.pragmas)
+        return con
+
+    def take(self, con):
+        with self.lock:
+            self.held[con] = threading.get_ident()
+        return con
+
+    def acquire(self):
+        try:
+            return self.take(self.idle.get_nowait())
+        except queue.Empty:
+            pass
+
+        with self.lock:
+            create = self.created < self.size
+            if create:
+                self.created += 1
+            # Open streams on this thread hold every connection, waiting for one would never end
+            ownsAll = not create and list(self.held.values()).count(threading.get_ident()) >= self.size
+        if create:
+            return self.take(self.connect())
+
+        if not ownsAll:
+            try:
+                return self.take(self.idle.get(timeout=self.wait))
+            except queue.Empty:
+                pass
+
+        # Past the pool size a temporary connection is opened, and closed when it's released
+        con = self.connect()
+        with self.lock:
+            self.extra.add(con)
+        return con
+
+    def release(self, con):
+        with self.lock:
+            self.held.pop(con, None)
+            temporary = con in self.extra
+            self.extra.discard(con)
+
+        if temporary:
+            con.close()
+        else:
+            self.idle.put(con)
+
+    @contextmanager
+    def connection(self):
+        con = self.acquire()
+        try:
+            yield con
+        finally:
+            self.release(con)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
 
 class DatabaseHandler:
-    def __init__(self, file):
+    def __init__(self, file, pragmas=None, readers=4):
+        pragmas = {**PRAGMAS, **(pragmas or {})}
+
+        # One connection does all the writing, reads go through a pool so other threads can query during a sync
         self.con = sqlite3.Connection(file)
+        applyPragmas(self.con, pragmas)
         self.cursor = self.con.cursor()
 
+        inMemory = file in (":memory:", "") or str(file).startswith("file:")
+        readerPragmas = {k: v for k, v in pragmas.items() if k != 'journal_mode'}
+        self.readers = None if inMemory or not readers else ReaderPool(file, readers, readerPragmas)
+
+        # Notified of inserted and edited transactions, e.g. the aggregate cache
+        self.observers = []
+
         self.cursor.execute(
             ''' 
             CREATE TABLE IF NOT EXISTS linked_accounts (
@@ -22,7 +313,7 @@ class DatabaseHandler:
                 `link_id` INT,
                 `type` VARCHAR(64),
                 `display_name` TEXT,
-                `overdraft` DECIMAL,
+                `overdraft` INTEGER,
                 `currency` VARCHAR(4),
                 `account_number` VARCHAR(8),
                 `sort_code` VARCHAR(8),
@@ -40,7 +331,7 @@ class DatabaseHandler:
                 `link_id` INT,
                 `type` VARCHAR(64),
                 `display_name` TEXT,
-                `credit_limit` DECIMAL,
+                `credit_limit` INTEGER,
                 `payment_date` DATE,
                 `currency` VARCHAR(4),
                 `card_number` VARCHAR(8),
@@ -58,14 +349,14 @@ class DatabaseHandler:
                 `normalised_id` VARCHAR(128),
                 `account_id` VARCHAR(32) NOT NULL,
                 `timestamp` DATE NOT NULL,
-                `amount` DECIMAL NOT NULL,
+                `amount` INTEGER NOT NULL,
                 `currency` VARCHAR(4) NOT NULL,
                 `merchant_name` VARCHAR(128),
                 `description` TEXT,
                 `type` VARCHAR(10) NOT NULL,
                 `category` VARCHAR(64),
                 `classification` TEXT,
-                `balance_amount` DECIMAL,
+                `balance_amount` INTEGER,
                 `balance_currency` VARCHAR(4),
                 `unstructured` TEXT,
                 FOREIGN KEY (account_id) REFERENCES accounts(account_id)
@@ -73,39 +364,207 @@ class DatabaseHandler:
             '''
         )
 
+        self.cursor.execute(PENDING_TABLE)
+
+        # Closing balance per day for accounts and cards, maintained on ingest
         self.cursor.execute(
             '''
-            CREATE TABLE IF NOT EXISTS `pending_transactions` (
-                `id` INTEGER PRIMARY KEY AUTOINCREMENT,
-                `normalised_id` VARCHAR(128),
+            CREATE TABLE IF NOT EXISTS `daily_balances` (
                 `account_id` VARCHAR(32) NOT NULL,
-                `timestamp` DATE NOT NULL,
-                `amount` DECIMAL NOT NULL,
-                `currency` VARCHAR(4) NOT NULL,
-                `merchant_name` VARCHAR(128),
-                `description` TEXT,
-                `type` VARCHAR(10) NOT NULL,
-                `category` VARCHAR(64),
-                `classification` TEXT,
-                FOREIGN KEY (account_id) REFERENCES accounts(account_id)
+                `date` DATE NOT NULL,
+                `balance` INTEGER NOT NULL,
+                `currency` VARCHAR(4),
+                PRIMARY KEY (`account_id`, `date`)
+            ) WITHOUT ROWID;
+            '''
+        )
+
+        self.cursor.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS `classifications` (
+                `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+                `name` VARCHAR(64) NOT NULL UNIQUE
+            );
+            '''
+        )
+
+        self.cursor.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS `sub_classifications` (
+                `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+                `classification_id` INTEGER NOT NULL,
+                `name` VARCHAR(64) NOT NULL,
+                UNIQUE (`classification_id`, `name`),
+                FOREIGN KEY (classification_id) REFERENCES classifications(id)
             );
             '''
         )
 
         self.cursor.execute(
             '''
-            CREATE TABLE IF NOT EXISTS `cardsBalance` (
+            CREATE TABLE IF NOT EXISTS `category_rules` (
+                `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+                `kind` VARCHAR(8) NOT NULL,
+                `field` VARCHAR(16) NOT NULL,
+                `pattern` TEXT NOT NULL,
+                `category` VARCHAR(64) NOT NULL,
+                `sub_category` VARCHAR(64) NOT NULL
+            );
+            '''
+        )
+
+        self.cursor.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS `sync_state` (
                 `account_id` VARCHAR(32) NOT NULL,
-                `timestamp` DATE NOT NULL,
-                `balance` DECIMAL NOT NULL,
-                PRIMARY KEY (`account_id`, `timestamp`),
-                FOREIGN KEY (account_id) REFERENCES cards(account_id)
+                `high_water` DATE,
+                `last_success` TIMESTAMP,
+                PRIMARY KEY (`account_id`)
             );
             '''
         )
 
         self.con.commit()
 
+        self.loadClassifications()
+        self.migrate()
+
+    def migrate(self):
+        version = self.cursor.execute("PRAGMA user_version").fetchone()[0]
+
+        if version >= len(MIGRATIONS):
+            return
+
+        try:
+            self.cursor.execute("BEGIN")
+            for version, statements in enumerate(MIGRATIONS[version:], version + 1):
+                for statement in statements:
+                    if callable(statement):
+                        statement(self)
+                    else:
+                        self.cursor.execute(statement)
+                self.cursor.execute(f"PRAGMA user_version = {version}")
+        except Exception:
+            self.con.rollback()
+            self.loadClassifications()
+            raise
+
+        self.con.commit()
+
+    @contextmanager
+    def reader(self):
+        # In-memory databases can't be opened twice, so they read from the writer
+        if self.readers is None:
+            yield self.con
+            return
+
+        with self.readers.connection() as con:
+            yield con
+
+    def close(self):
+        if self.readers:
+            self.readers.close()
+        self.con.close()
+
+    def loadClassifications(self):
+        res = self.cursor.execute("SELECT id, name FROM classifications")
+        self.classificationNames = dict(res.fetchall())
+        self.classificationIds = {name: id for id, name in self.classificationNames.items()}
+
+        res = self.cursor.execute("SELECT id, classification_id, name FROM sub_classifications")
+        subs = res.fetchall()
+        self.subClassificationNames = {id: name for id, _, name in subs}
+        self.subClassificationIds = {(parent, name): id for id, parent, name in subs}
+
+    def refreshClassifications(self, con=None):
+        # Merged rather than replaced, so ids added in this handler's open transaction stay known
+        con = con or self.con
+        names = con.execute("SELECT id, name FROM classifications").fetchall()
+        self.classificationNames.update(names)
+        self.classificationIds.update((name, id) for id, name in names)
+
+        subs = con.execute("SELECT id, classification_id, name FROM sub_classifications").fetchall()
+        self.subClassificationNames.update((id, name) for id, _, name in subs)
+        self.subClassificationIds.update(((parent, name), id) for id, parent, name in subs)
+
+    def classificationToIds(self, classification):
+        if not classification:
+            return (None, None)
+
+        category = classification[0]
+        classification_id = self.classificationIds.get(category)
+        if classification_id is None:
+            self.refreshClassifications()
+            classification_id = self.classificationIds.get(category)
+        if classification_id is None:
+            classification_id = self.con.execute(
+                "INSERT INTO classifications (name) VALUES (?)",
+                (category,)
+            ).lastrowid
+            self.classificationNames[classification_id] = category
+            self.classificationIds[category] = classification_id
+
+        if len(classification) < 2 or not classification[1]:
+            return (classification_id, None)
+
+        sub = classification[1]
+        sub_id = self.subClassificationIds.get((classification_id, sub))
+        if sub_id is None:
+            self.refreshClassifications()
+            sub_id = self.subClassificationIds.get((classification_id, sub))
+        if sub_id is None:
+            sub_id = self.con.execute(
+                "INSERT INTO sub_classifications (classification_id, name) VALUES (?,?)",
+                (classification_id, sub)
+            ).lastrowid
+            self.subClassificationNames[sub_id] = sub
+            self.subClassificationIds[(classification_id, sub)] = sub_id
+
+        return (classification_id, sub_id)
+
+    def classificationFromIds(self, classification_id, sub_id, con=None):
+        if classification_id is None:
+            return []
+
+        # Another handler or process may have added it since the maps were loaded
+        if classification_id not in self.classificationNames or (sub_id is not None and sub_id not in self.subClassificationNames):
+            self.refreshClassifications(con)
+
+        if sub_id is None:
+            return [self.classificationNames[classification_id]]
+        return [self.classificationNames[classification_id], self.subClassificationNames[sub_id]]
+
+    def recordCursor(self, record, con=None):
+        cursor = (con or self.con).cursor()
+        cursor.row_factory = RowFactory(record, self.classificationFromIds)
+        return cursor
+
+    def migrateClassifications(self):
+        for category in CATALOGUE.categories:
+            self.classificationToIds([category])
+            for sub in CATALOGUE.subCategories[category]:
+                self.classificationToIds([category, sub])
+
+        res = self.cursor.execute(
+            "SELECT DISTINCT classification FROM transactions WHERE classification IS NOT NULL"
+        )
+        for (text,) in res.fetchall():
+            try:
+                ids = self.classificationToIds(json.loads(text))
+            except (ValueError, TypeError, IndexError):
+                ids = (None, None)
+
+            self.cursor.execute(
+                '''
+                UPDATE transactions SET
+                classification_id = ?,
+                sub_classification_id = ?,
+                classification = NULL
+                WHERE classification = ?
+                ''',
+                (*ids, text)
+            )
+
     def addRefreshToken(self, refresh_token):
         self.cursor.execute(
             '''
@@ -127,19 +586,34 @@ class DatabaseHandler:
         if link_id:
             res = self.cursor.execute(
                 '''
-                SELECT * FROM linked_accounts
+                SELECT id, refresh_token, access_token, expires_at
+                FROM linked_accounts
                 WHERE id = ?
                 ''',
                 (link_id,)
             )
         else:
             res = self.cursor.execute(
-                "SELECT * FROM linked_accounts"
+                "SELECT id, refresh_token, access_token, expires_at FROM linked_accounts"
             )
         
         results = res.fetchall()
         return results
 
+    def setTokens(self, link_id, refresh_token, access_token, expires_at):
+        self.cursor.execute(
+            '''
+                UPDATE linked_accounts
+                SET refresh_token = ?,
+                access_token = ?,
+                expires_at = ?
+                WHERE id = ?
+            ''',
+            (refresh_token, access_token, expires_at, link_id)
+        )
+
+        self.con.commit()
+
     def addCard(self, **kwargs):
         link_id = kwargs.get('link_id', None)
         if not link_id:
@@ -158,7 +632,7 @@ class DatabaseHandler:
             link_id,
             kwargs['card_type'],
             kwargs['display_name'],
-            kwargs.get('credit_limit', 0),
+            toMinor(kwargs.get('credit_limit', 0), kwargs['currency']),
             kwargs['currency'],
             kwargs['partial_card_number'],
         )
@@ -204,7 +678,7 @@ class DatabaseHandler:
             link_id,
             kwargs['account_type'],
             kwargs['display_name'],
-            kwargs.get('overdraft', 0),
+            toMinor(kwargs.get('overdraft', 0), kwargs['currency']),
             kwargs['currency'],
             kwargs['account_number']['number'],
             kwargs['account_number']['sort_code'],
@@ -234,6 +708,14 @@ class DatabaseHandler:
 
         return self.cursor.lastrowid
     
+    def accountCurrency(self, account_id, cards=False):
+        res = self.cursor.execute(
+            f"SELECT currency FROM {'cards' if cards else 'accounts'} WHERE account_id = ?",
+            (account_id,)
+        )
+        row = res.fetchone()
+        return row[0] if row else None
+
     def setOverdraft(self, account_id, overdraft):
         self.cursor.execute(
             '''
@@ -241,7 +723,7 @@ class DatabaseHandler:
                 SET overdraft = ?
                 WHERE account_id = ?
             ''',
-            (overdraft, account_id)
+            (toMinor(overdraft, self.accountCurrency(account_id)), account_id)
         )
 
         self.con.commit()
@@ -253,7 +735,7 @@ class DatabaseHandler:
                 SET credit_limit = ?
                 WHERE account_id = ?
             ''',
-            (limit, account_id)
+            (toMinor(limit, self.accountCurrency(account_id, cards=True)), account_id)
         )
 
         self.con.commit()
@@ -271,49 +753,307 @@ class DatabaseHandler:
         self.con.commit()
 
     def getAccounts(self, link_id=None, cards=False):
-        table = 'cards' if cards else 'accounts'
+        cursor = self.recordCursor(Card if cards else Account)
         if link_id:
-            res = self.cursor.execute(
+            res = cursor.execute(SELECT_LINK_CARDS if cards else SELECT_LINK_ACCOUNTS, (link_id,))
+        else:
+            res = cursor.execute(SELECT_CARDS if cards else SELECT_ACCOUNTS)
+
+        return res.fetchall()
+
+    def getAccountLinks(self):
+        res = self.cursor.execute(
+            '''
+            SELECT account_id, link_id, 0 FROM accounts
+            UNION ALL
+            SELECT account_id, link_id, 1 FROM cards
+            '''
+        )
+
+        return res.fetchall()
+
+    def insertTransaction(self, **kwargs):
+        account_id = kwargs.pop('account_id')
+        return self.insertTransactions(account_id, [kwargs])
+
+    def insertTransactions(self, account_id, transactions, chunk_size=500, current_balance=None):
+        dates = []
+
+        def toInsert(transaction):
+            running_balance = transaction.get('running_balance', None)
+            balance_currency = None if not running_balance else running_balance['currency']
+            balance_amount = None if not running_balance else toMinor(running_balance['amount'], balance_currency)
+
+            dates.append(transaction['timestamp'][:10])
+            return (
+                transaction.get('normalised_provider_transaction_id') or transaction['transaction_id'],
+                account_id,
+                transaction['timestamp'][:10],
+                toMinor(transaction['amount'], transaction['currency']),
+                transaction['currency'],
+                transaction.get('merchant_name', None),
+                transaction['description'],
+                transaction['transaction_type'],
+                transaction['transaction_category'],
+                *self.classificationToIds(transaction['transaction_classification']),
+                balance_amount,
+                balance_currency
+            )
+
+        rows = map(toInsert, transactions)
+        inserted = 0
+        lastId = self.cursor.execute("SELECT MAX(id) FROM transactions").fetchone()[0] or 0
+        try:
+            while True:
+                chunk = list(islice(rows, chunk_size))
+                if not chunk:
+                    break
+
+                # Rows already stored are skipped by the unique (normalised_id, account_id) index
+                # rowcount only counts this statement's rows, not FTS trigger or classification writes
+                self.cursor.executemany(INSERT_TRANSACTION, chunk)
+                inserted += self.cursor.rowcount
+
+            if inserted or current_balance is not None:
+                self.updateBalances(account_id, min(dates, default=None), current_balance)
+        except Exception:
+            self.con.rollback()
+            self.loadClassifications()
+            raise
+
+        self.con.commit()
+
+        if inserted and self.observers:
+            res = self.cursor.execute(SELECT_INSERTED_SUMMARIES, (lastId, account_id))
+            rows = [(*row[:4], self.classificationFromIds(*row[4:])) for row in res.fetchall()]
+            for observer in self.observers:
+                observer.transactionsInserted(rows)
+
+        return inserted
+    
+    def getTransactions(self, account_id, date_from=None, date_to=None):
+        return list(self.iterTransactions(account_id, date_from, date_to))
+
+    def iterTransactions(
+            self,
+            account_id,
+            date_from=None,
+            date_to=None,
+            columns=None,
+            after=None,
+            batch_size=500,
+            descending=False,
+            limit=None
+        ):
+        account_ids = [account_id] if isinstance(account_id, str) else list(account_id)
+        columns = columns or TRANSACTION_COLUMNS
+        unknown = set(columns) - set(TRANSACTION_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown transaction columns: {', '.join(sorted(unknown))}")
+
+        conditions = [f"account_id IN ({','.join('?' * len(account_ids))})"]
+        params = account_ids
+        if date_from and date_to:
+            conditions.append("timestamp BETWEEN ? AND ?")
+            params += [str(date_from), str(date_to)]
+        if after:
+            # Keyset pagination, resume after the last (timestamp, id) seen
+            conditions.append(f"(timestamp, id) {'<' if descending else '>'} (?, ?)")
+            params += list(after)
+
+        order = "DESC" if descending else "ASC"
+        limitString = ""
+        if limit:
+            limitString = "LIMIT ?"
+            params.append(limit)
+
+        # Classifications are read from their ids, no JSON is decoded
+        keys = []
+        for column in columns:
+            keys += ['classification_id', 'sub_classification_id'] if column == 'classification' else [column]
+
+        # Amounts need their currency to be scaled from minor units
+        for amount, currency in (('amount', 'currency'), ('balance_amount', 'balance_currency')):
+            if amount in keys and currency not in keys:
+                keys.append(currency)
+
+        # The reader is held until the stream is exhausted or closed
+        with self.reader() as con:
+            res = self.recordCursor(Transaction, con).execute(
                 f'''
-                SELECT * FROM {table}
-                WHERE link_id = ?
+                SELECT {', '.join(keys)} FROM transactions
+                WHERE {' AND '.join(conditions)}
+                ORDER BY timestamp {order}, id {order}
+                {limitString};
                 ''',
-                (link_id, )
+                params
             )
+
+            while True:
+                results = res.fetchmany(batch_size)
+                if not results:
+                    break
+
+                yield from results
+
+    def searchTransactions(self, query, page_size=50, **filters):
+        return next(self.iterSearchTransactions(query, page_size, **filters), [])
+
+    def iterSearchTransactions(
+            self,
+            query,
+            page_size=50,
+            account_ids=None,
+            date_from=None,
+            date_to=None,
+            min_amount=None,
+            max_amount=None,
+            prefix=True
+        ):
+        # Each word is quoted so user input can't inject FTS syntax, a trailing * makes it a prefix query
+        terms = [term.replace('"', '""') for term in query.split()]
+        if not terms:
+            return
+
+        match = " ".join(f'"{term}"' + ("*" if prefix else "") for term in terms)
+
+        filters = []
+        filterParams = []
+        if account_ids:
+            account_ids = [account_ids] if isinstance(account_ids, str) else list(account_ids)
+            filters.append(f"account_id IN ({','.join('?' * len(account_ids))})")
+            filterParams += account_ids
+        if date_from:
+            filters.append("timestamp >= ?")
+            filterParams.append(str(date_from))
+        if date_to:
+            filters.append("timestamp <= ?")
+            filterParams.append(str(date_to))
+        # Bounds are in major units, scaled by each row's own currency
+        if min_amount is not None:
+            filters.append(f"amount >= {minorSql('?', 'currency')}")
+            filterParams.append(float(min_amount))
+        if max_amount is not None:
+            filters.append(f"amount <= {minorSql('?', 'currency')}")
+            filterParams.append(float(max_amount))
+
+        conditions = ["transactions_fts MATCH ?"]
+        params = [match]
+
+        # Common terms can match a large share of the ledger. With an account and a date range the
+        # (account_id, timestamp) index picks the few candidate rows first, so only those are joined
+        # and scored. The unary + keeps FTS5 from evaluating the MATCH once per candidate rowid
+        if account_ids and (date_from or date_to):
+            conditions.append(f"+transactions_fts.rowid IN (SELECT id FROM transactions WHERE {' AND '.join(filters)})")
         else:
-            res = self.cursor.execute(
-                f"SELECT * FROM {table}"
+            conditions += filters
+        params += filterParams
+
+        # Merchant matches rank above description matches
+        with self.reader() as con:
+            res = self.recordCursor(SearchResult, con).execute(
+                f'''
+                SELECT t.*, bm25(transactions_fts, 2.0, 1.0) AS rank
+                FROM transactions_fts
+                JOIN transactions AS t ON t.id = transactions_fts.rowid
+                WHERE {' AND '.join(conditions)}
+                ORDER BY rank, t.id
+                ''',
+                params
             )
 
-        results = res.fetchall()
-        keys = [x[0] for x in self.cursor.description]
+            while True:
+                results = res.fetchmany(page_size)
+                if not results:
+                    break
 
-        return [{k: v for k,v in zip(keys, result)} for result in results] if results else []
+                yield results
 
+    def getTransaction(self, id=None, normalised_id=None):
+        cursor = self.recordCursor(Transaction)
+        if id is not None:
+            res = cursor.execute(SELECT_TRANSACTION, (id,))
+        else:
+            res = cursor.execute(SELECT_TRANSACTION_BY_NORMALISED_ID, (normalised_id,))
 
-    def insertTransaction(self, **kwargs):
-        running_balance = kwargs.get('running_balance', None)
-        balance_amount = None if not running_balance else running_balance['amount']
-        balance_currency = None if not running_balance else running_balance['currency']
+        return res.fetchone()
+
+    def updateTransaction(self, **kwargs):
+        return self.updateTransactions([kwargs])[0]
+
+    def updateTransactions(self, updates):
+        for update in updates:
+            CATALOGUE.validate(update['classification'])
+
+        changes = []
+        out = []
+        cursor = self.recordCursor(Transaction)
+
+        try:
+            for update in updates:
+                old = None
+                if self.observers:
+                    old = self.cursor.execute(SELECT_TRANSACTION_SUMMARY, (update['id'],)).fetchone()
+                    if old:
+                        old = (*old[:4], self.classificationFromIds(*old[4:]))
+
+                inserts = (
+                    update['merchant_name'],
+                    *self.classificationToIds(update['classification']),
+                    update['description'],
+                    update['id']
+                )
 
+                # RETURNING hands back the updated row without a second query
+                transaction = cursor.execute(UPDATE_TRANSACTION, inserts).fetchone()
+                out.append(transaction)
+
+                if old:
+                    changes.append((old, transaction['classification']))
+        except Exception:
+            self.con.rollback()
+            self.loadClassifications()
+            raise
+
+        self.con.commit()
+
+        for old, classification in changes:
+            for observer in self.observers:
+                observer.transactionUpdated(old, classification)
+
+        return out
+
+    def insertPendingTransaction(self, **kwargs):
+        account_id = kwargs.pop('account_id')
+        try:
+            self.insertPending(account_id, [kwargs])
+        except Exception:
+            self.con.rollback()
+            self.loadClassifications()
+            raise
+
+        self.con.commit()
+
+    def insertPending(self, account_id, transactions):
         inserts = (
-            kwargs['normalised_provider_transaction_id'],
-            kwargs['account_id'],
-            kwargs['timestamp'][:10],
-            kwargs['amount'],
-            kwargs['currency'],
-            kwargs.get('merchant_name', None),
-            kwargs['description'],
-            kwargs['transaction_type'],
-            kwargs['transaction_category'],
-            json.dumps(kwargs['transaction_classification']),
-            balance_amount,
-            balance_currency
+            (
+                transaction.get('normalised_provider_transaction_id') or transaction.get('transaction_id'),
+                account_id,
+                transaction['timestamp'][:10],
+                toMinor(transaction['amount'], transaction['currency']),
+                transaction['currency'],
+                transaction.get('merchant_name', None),
+                transaction['description'],
+                transaction['transaction_type'],
+                transaction['transaction_category'],
+                *self.classificationToIds(transaction.get('transaction_classification')),
             )
+            for transaction in transactions
+        )
 
-        self.cursor.execute(
+        self.cursor.executemany(
             '''
-            INSERT INTO transactions (
+            INSERT INTO pending_transactions (
                 normalised_id,
                 account_id,
                 timestamp,
@@ -323,142 +1063,335 @@ class DatabaseHandler:
                 description,
                 type,
                 category,
-                classification,
-                balance_amount,
-                balance_currency
+                classification_id,
+                sub_classification_id
             )
             VALUES (
-                ?,?,?,?,?,?,?,?,?,?,?,?
+                ?,?,?,?,?,?,?,?,?,?,?
             )
             ''',
             inserts
         )
 
+    def replacePendingTransactions(self, account_id, transactions, tolerance_days=3):
+        # The provider always returns the full pending list, so the old one is dropped
+        try:
+            self.cursor.execute("DELETE FROM pending_transactions WHERE account_id = ?", (account_id,))
+            self.insertPending(account_id, transactions)
+            unmatched = self.reconcilePending(account_id, tolerance_days)
+        except Exception:
+            self.con.rollback()
+            self.loadClassifications()
+            raise
+
         self.con.commit()
-    
-    def getTransactions(self, account_id, date_from=None, date_to=None):
-        if date_from and date_to:
+        return unmatched
+
+    def reconcilePending(self, account_id, tolerance_days=3):
+        res = self.cursor.execute(
+            '''
+            SELECT id, normalised_id, timestamp, amount, merchant_name
+            FROM pending_transactions
+            WHERE account_id = ? AND settled_id IS NULL
+            ORDER BY timestamp, id
+            ''',
+            (account_id,)
+        )
+        pending = res.fetchall()
+
+        claimed = {
+            row[0] for row in self.cursor.execute(
+                "SELECT settled_id FROM pending_transactions WHERE account_id = ? AND settled_id IS NOT NULL",
+                (account_id,)
+            )
+        }
+
+        matches = []
+        for id, normalised_id, timestamp, amount, merchant_name in pending:
+            # Same provider id first, otherwise the closest settled row with the same amount
             res = self.cursor.execute(
-                '''
-                SELECT * FROM transactions
-                WHERE timestamp BETWEEN ? AND ?
-                ORDER BY timestamp;
-                ''',
-                (date_from, date_to)
+                "SELECT id FROM transactions WHERE normalised_id = ? AND account_id = ?",
+                (normalised_id, account_id)
             )
-        else:
+            candidates = [row[0] for row in res]
+
             res = self.cursor.execute(
                 '''
-                SELECT * FROM transactions
-                ORDER BY timestamp;
-                '''
+                SELECT id FROM transactions
+                WHERE account_id = ?
+                AND amount = ?
+                AND timestamp BETWEEN date(?, ?) AND date(?, ?)
+                AND (? IS NULL OR merchant_name IS NULL OR merchant_name = ? COLLATE NOCASE)
+                ORDER BY abs(julianday(timestamp) - julianday(?)), id
+                ''',
+                (
+                    account_id,
+                    amount,
+                    timestamp, f"-{tolerance_days} days",
+                    timestamp, f"+{tolerance_days} days",
+                    merchant_name, merchant_name,
+                    timestamp
+                )
             )
+            candidates += [row[0] for row in res]
 
-        results = res.fetchall()
-        keys = [x[0] for x in self.cursor.description]
-
-        out = [{k: v for k,v in zip(keys, result)} for result in results] if results else []
+            settled_id = next((c for c in candidates if c not in claimed), None)
+            if settled_id is not None:
+                claimed.add(settled_id)
+                matches.append((settled_id, id))
 
-        for transaction in out:
-            transaction['classification'] = json.loads(transaction['classification'])
-        
-        return out
-
-    def getTransaction(self, id=None, normalised_id=None):
-        idString = "id" if id else "normalised_id"
+        self.cursor.executemany(
+            "UPDATE pending_transactions SET settled_id = ? WHERE id = ?",
+            matches
+        )
+        return len(pending) - len(matches)
 
-        res = self.cursor.execute(
+    def getPendingTransactions(self, account_id, include_settled=False):
+        res = self.recordCursor(PendingTransaction).execute(
             f'''
-            SELECT * FROM transactions
-            WHERE {idString}=?
+            SELECT * FROM pending_transactions
+            WHERE account_id = ?
+            {'' if include_settled else 'AND settled_id IS NULL'}
+            ORDER BY timestamp DESC, id DESC
             ''',
-            (id or normalised_id, )
+            (account_id,)
         )
 
-        out = res.fetchone()
-        out =  {k[0]:v for k, v in zip(self.cursor.description, out)} if out else None
+        return res.fetchall()
 
-        out['classification'] = json.loads(out['classification'])
-        return out
+    def getLastTransaction(self, account_id):
+        res = self.recordCursor(Transaction).execute(SELECT_LAST_TRANSACTION, (account_id,))
+        return res.fetchone()
 
-    def updateTransaction(self, **kwargs):
-        inserts = (
-            kwargs['merchant_name'],
-            json.dumps(kwargs['classification']),
-            kwargs['description'],
-            kwargs['id']
-        )
+    def addRule(self, kind, field, pattern, category, sub_category):
+        return self.addRules([(kind, field, pattern, category, sub_category)])[0]
 
+    def addRules(self, rules):
+        # One commit for the lot, ids are read per row since executemany doesn't return them
+        rule_ids = []
+        try:
+            for rule in rules:
+                self.cursor.execute(
+                    '''
+                    INSERT INTO category_rules (
+                        kind,
+                        field,
+                        pattern,
+                        category,
+                        sub_category
+                    )
+                    VALUES (
+                        ?,?,?,?,?
+                    )
+                    ''',
+                    rule
+                )
+                rule_ids.append(self.cursor.lastrowid)
+        except Exception:
+            self.con.rollback()
+            raise
+
+        self.con.commit()
+
+        return rule_ids
+
+    def deleteRule(self, rule_id):
         self.cursor.execute(
-            '''
-            UPDATE transactions SET
-            merchant_name = ?,
-            classification = ?,
-            description = ?
-            WHERE id = ?
-            ''',
-            inserts
+            "DELETE FROM category_rules WHERE id = ?",
+            (rule_id,)
         )
 
         self.con.commit()
 
-    def insertPendingTransaction(self, **kwargs):
-        inserts = (
-            kwargs['normalised_provider_transaction_id'],
-            kwargs['account_id'],
-            kwargs['timestamp'][:10],
-            kwargs['amount'],
-            kwargs['currency'],
-            kwargs.get('merchant_name', None),
-            kwargs['description'],
-            kwargs['transaction_type'],
-            kwargs['transaction_category'],
-            str(kwargs['transaction_classification']),
+    def getRules(self):
+        res = self.cursor.execute(
+            "SELECT id, kind, field, pattern, category, sub_category FROM category_rules ORDER BY id"
+        )
+
+        return res.fetchall()
+
+    def setClassifications(self, changes):
+        # changes are (old row, new classification) pairs, old rows as passed to observers
+        try:
+            self.cursor.executemany(
+                '''
+                UPDATE transactions SET
+                classification_id = ?,
+                sub_classification_id = ?
+                WHERE id = ?
+                ''',
+                ((*self.classificationToIds(classification), old[0]) for old, classification in changes)
             )
+        except Exception:
+            self.con.rollback()
+            self.loadClassifications()
+            raise
 
+        self.con.commit()
+
+        for old, classification in changes:
+            for observer in self.observers:
+                observer.transactionUpdated(old, classification)
+
+    def getSyncState(self):
+        res = self.cursor.execute(
+            "SELECT account_id, high_water, last_success FROM sync_state"
+        )
+
+        return {account_id: (high_water, last_success) for account_id, high_water, last_success in res.fetchall()}
+
+    def setSyncState(self, account_id, high_water, last_success):
         self.cursor.execute(
             '''
-            INSERT INTO transactions (
-                normalised_id,
+            INSERT OR REPLACE INTO sync_state (
                 account_id,
-                timestamp,
-                amount,
-                currency,
-                merchant_name,
-                description,
-                type,
-                category,
-                classification,
-                balance_amount,
-                balance_currency
+                high_water,
+                last_success
             )
             VALUES (
-                ?,?,?,?,?,?,?,?,?,?,?,?
+                ?,?,?
             )
             ''',
-            inserts
+            (account_id, high_water, last_success)
         )
 
         self.con.commit()
 
-    def getLastTransaction(self, account_id):
+    def getTransactionAccounts(self):
+        res = self.cursor.execute(
+            "SELECT DISTINCT account_id FROM transactions"
+        )
+
+        return [x[0] for x in res.fetchall()]
+
+    def updateBalances(self, account_id, date_from=None, current_balance=None):
+        if date_from:
+            res = self.cursor.execute(
+                '''
+                SELECT balance FROM daily_balances
+                WHERE account_id = ? AND date < ?
+                ORDER BY date DESC LIMIT 1
+                ''',
+                (account_id, date_from)
+            )
+            previous = res.fetchone()
+            running = previous[0] if previous else 0
+        else:
+            previous = None
+            running = 0
+            date_from = ''
+
+        # Net movement per day, plus the provider's closing balance when it sent one
         res = self.cursor.execute(
             '''
-            SELECT 
-            *
-            FROM 
-            transactions 
-            WHERE account_id=?
-            ORDER BY timestamp DESC, id DESC LIMIT 1
+            SELECT
+                timestamp,
+                SUM(amount),
+                (
+                    SELECT balance_amount FROM transactions AS last
+                    WHERE last.account_id = day.account_id
+                    AND last.timestamp = day.timestamp
+                    AND last.balance_amount IS NOT NULL
+                    ORDER BY last.id DESC LIMIT 1
+                ),
+                MAX(COALESCE(balance_currency, currency))
+            FROM transactions AS day
+            WHERE account_id = ? AND timestamp >= ?
+            GROUP BY timestamp
+            ORDER BY timestamp
             ''',
-            (account_id,)
+            (account_id, date_from)
+        )
+
+        balances = []
+        movements = []
+        provided = False
+        for day, movement, provider_balance, currency in res.fetchall():
+            if provider_balance is not None:
+                # With nothing stored before them, earlier days are worked back from the first provider balance
+                if not provided and previous is None:
+                    closing = provider_balance - movement
+                    for balance, earlier in zip(reversed(balances), reversed(movements)):
+                        balance[2] = closing
+                        closing -= earlier
+
+                running = provider_balance
+                provided = True
+            else:
+                running += movement
+            balances.append([account_id, day, running, currency])
+            movements.append(movement)
+
+        # Without provider balances the series is anchored on the current balance
+        if current_balance is not None and balances and not provided:
+            offset = toMinor(current_balance, balances[-1][3]) - balances[-1][2]
+            for balance in balances:
+                balance[2] += offset
+
+        self.cursor.executemany(
+            '''
+            INSERT OR REPLACE INTO daily_balances (
+                account_id,
+                date,
+                balance,
+                currency
+            )
+            VALUES (
+                ?,?,?,?
+            )
+            ''',
+            balances
         )
 
-        out = res.fetchone()
-        return {k[0]:v for k, v in zip(self.cursor.description, out)} if out else None
+    def rebuildBalances(self, account_id=None, current_balance=None):
+        account_ids = [account_id] if account_id else self.getTransactionAccounts()
+
+        try:
+            for account_id in account_ids:
+                self.cursor.execute(
+                    "DELETE FROM daily_balances WHERE account_id = ?",
+                    (account_id,)
+                )
+                self.updateBalances(account_id, current_balance=current_balance)
+        except Exception:
+            self.con.rollback()
+            raise
+
+        self.con.commit()
+
+    def getBalance(self, account_id, date=None):
+        with self.reader() as con:
+            if date:
+                res = con.execute(
+                    '''
+                    SELECT balance, currency FROM daily_balances
+                    WHERE account_id = ? AND date <= ?
+                    ORDER BY date DESC LIMIT 1
+                    ''',
+                    (account_id, str(date))
+                )
+            else:
+                res = con.execute(
+                    '''
+                    SELECT balance, currency FROM daily_balances
+                    WHERE account_id = ?
+                    ORDER BY date DESC LIMIT 1
+                    ''',
+                    (account_id,)
+                )
+
+            row = res.fetchone()
+            return (fromMinor(row[0], row[1]), row[1]) if row else None
+
+    def getBalanceSeries(self, account_id, date_from, date_to):
+        with self.reader() as con:
+            res = con.execute(
+                '''
+                SELECT date, balance, currency FROM daily_balances
+                WHERE account_id = ? AND date BETWEEN ? AND ?
+                ORDER BY date
+                ''',
+                (account_id, str(date_from), str(date_to))
+            )
 
-    def getBalance(self, account_id):
-        last = self.getLastTransaction(account_id)
-        if last:
-            return (last['balance_amount'], last['balance_currency'])
-        return None
\ No newline at end of file
+            return [(day, fromMinor(balance, currency)) for day, balance, currency in res.fetchall()]
\ No newline at end of file
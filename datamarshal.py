@@ -1,11 +1,14 @@
 from calendar import month
 import os
-import requests
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import date, datetime, timedelta
 
 from database import DatabaseHandler
-from truelayer import TrueLayerHandler
+from money import toMinor
+from truelayer import DeadlineExceeded, TrueLayerHandler, createSession
 
+import requests
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -14,45 +17,119 @@ CLIENT_ID = os.getenv("TRUELAYER_CLIENT_ID")
 CLIENT_SECRET = os.getenv("TRUELAYER_CLIENT_SECRET")
 REDIRECT_URI = os.getenv("TRUELAYER_REDIRECT_URI")
 
+# Rough cost of an extra request, in days of transactions, when planning a sync
+REQUEST_COST_DAYS = 7
+
+# Days re-fetched before the last synced date, duplicates are ignored on insert
+SYNC_OVERLAP_DAYS = 2
+
+class FetchFailed(Exception):
+    def __init__(self, status, error):
+        super().__init__(f"{status}: {error}")
+        self.status = status
+        self.error = error
+
+    @classmethod
+    def fromResponse(cls, response):
+        # tlRequest gives up with a message after repeated 401s
+        if isinstance(response, str):
+            return cls(401, response)
+
+        # Error bodies aren't always JSON, e.g. a gateway's HTML page
+        try:
+            data = response.json()
+        except ValueError:
+            return cls(response.status_code, response.text[:200])
+
+        error = data.get('error_description') or data.get('error') if isinstance(data, dict) else None
+        return cls(response.status_code, error or str(data)[:200])
+
+class HandlerRegistry(dict):
+    def __init__(self, factory):
+        super().__init__()
+        self.factory = factory
+
+    def __missing__(self, link_id):
+        handler = self[link_id] = self.factory(link_id)
+        return handler
+
 class DataMarshaller:
-    def __init__(self, dbHandler, ip=None):
-        self.ip = ip if ip else self.getIP()
+    def __init__(self, dbHandler, ip=None, session=None, ip_ttl=3600, rules=None):
+        # One pooled session is shared by every handler so connections are reused
+        self.session = session if session else createSession()
         self.db = dbHandler
+        self.rules = rules
+
+        # The IP is only looked up when a handler first needs it
+        self.cachedIP = ip
+        self.ip_ttl = None if ip else ip_ttl
+        self.ipFetched = time.monotonic()
 
-        self.tlHandlers = {}
+        self.tlHandlers = HandlerRegistry(self.loadHandler)
         self.accounts = {}
         self.accountToLink = {}
         self.cards = {}
         self.cardToLink = {}
+        self.tokenUpdates = set()
         self.loadTLHandlers()
 
+    @property
+    def ip(self):
+        expired = self.ip_ttl is not None and time.monotonic() - self.ipFetched > self.ip_ttl
+        if not self.cachedIP or expired:
+            self.cachedIP = self.getIP()
+            self.ipFetched = time.monotonic()
+
+        return self.cachedIP
+
     def getIP(self):
-        return requests.get('https://api.ipify.org').content.decode('utf8')
+        return self.session.get('https://api.ipify.org', timeout=10).content.decode('utf8')
+
+    def newHandler(self, refresh_token=None, link_id=None, access_token=None, expires_at=0):
+        tlHandler = TrueLayerHandler(
+            CLIENT_ID,
+            CLIENT_SECRET,
+            REDIRECT_URI,
+            lambda: self.ip,
+            refresh_token=refresh_token,
+            session=self.session,
+            access_token=access_token,
+            expires_at=expires_at,
+        )
+
+        if link_id:
+            self.watchTokens(link_id, tlHandler)
+
+        return tlHandler
+
+    def watchTokens(self, link_id, tlHandler):
+        # Refreshes can happen on sync threads, so they are queued and written by saveTokens
+        tlHandler.onTokenRefresh = lambda: self.tokenUpdates.add(link_id)
+
+    def saveTokens(self):
+        while self.tokenUpdates:
+            link_id = self.tokenUpdates.pop()
+            tlHandler = self.tlHandlers[link_id]
+            self.db.setTokens(
+                link_id,
+                tlHandler.refresh_token,
+                tlHandler.access_token,
+                tlHandler.expires_at
+            )
 
     def addAuth(self, refresh_token=None, exCode=None):
         if refresh_token:
             if refresh_token in {x[1] for x in self.db.getRefreshTokens()}:
                 return
 
-            tlHandler = TrueLayerHandler(
-                CLIENT_ID,
-                CLIENT_SECRET,
-                REDIRECT_URI,
-                self.ip,
-            )
-            tlHandler.refresh_token = refresh_token
+            tlHandler = self.newHandler(refresh_token)
             res = tlHandler.refreshAccessToken()
             if res.status_code != 200:
                 return res.json()
             
-            link_id = self.db.addRefreshToken(refresh_token)
+            link_id = self.db.addRefreshToken(tlHandler.refresh_token)
         elif exCode:
-            tlHandler = TrueLayerHandler(
-                CLIENT_ID,
-                CLIENT_SECRET,
-                REDIRECT_URI,
-                self.ip,
-            )
+            tlHandler = self.newHandler()
 
             res = tlHandler.authSetup(exCode)
             if res.status_code != 200:
@@ -65,25 +142,38 @@ class DataMarshaller:
             return
 
         self.tlHandlers[link_id] = tlHandler
+        self.watchTokens(link_id, tlHandler)
+        self.tokenUpdates.add(link_id)
 
         self.addAccounts(link_id)
         self.addCards(link_id)
-        self.loadTLHandlers()
+        self.saveTokens()
+        self.loadAccounts(link_id)
+        self.loadCards(link_id)
 
     def loadTLHandlers(self):
-        for link_id, refresh_token in self.db.getRefreshTokens():
-            tlHandler = TrueLayerHandler(
-                CLIENT_ID,
-                CLIENT_SECRET,
-                REDIRECT_URI,
-                self.ip, 
-                refresh_token=refresh_token
-            )
-
-            self.tlHandlers[link_id] = tlHandler
-            
-            self.loadAccounts(link_id)
-            self.loadCards(link_id)
+        self.tlHandlers.clear()
+        self.accounts.clear()
+        self.accountToLink.clear()
+        self.cards.clear()
+        self.cardToLink.clear()
+
+        # Handlers are built on first use, only the account maps are loaded up front
+        for account_id, link_id, card in self.db.getAccountLinks():
+            if card:
+                self.cards.setdefault(link_id, set()).add(account_id)
+                self.cardToLink[account_id] = link_id
+            else:
+                self.accounts.setdefault(link_id, set()).add(account_id)
+                self.accountToLink[account_id] = link_id
+
+    def loadHandler(self, link_id):
+        tokens = self.db.getRefreshTokens(link_id)
+        if not tokens:
+            raise KeyError(link_id)
+
+        _, refresh_token, access_token, expires_at = tokens[0]
+        return self.newHandler(refresh_token, link_id, access_token, expires_at)
 
     def loadAccounts(self, link_id):
         self.accounts[link_id] = set()
@@ -144,69 +234,209 @@ class DataMarshaller:
             self.db.addCard(link_id=link_id, **card)
             self.refreshOverdraft(card['account_id'], link_id, cards=True)
 
-    def pullTransactions(self):
+    def pullTransactions(self, max_workers=4, timeout=None, initial_days=60):
         today = date.today()
-
-        # Get latest date transactions were updated
-        for link, accounts in self.accounts.items():
-            lastestDate = datetime.strptime("3000-01-01",  '%Y-%m-%d').date()
-
-            for account in accounts:
-                accountLatestDate = datetime.strptime(self.db.getLastTransaction(account)['timestamp'] , '%Y-%m-%d').date()
-                if accountLatestDate < lastestDate:
-                    lastestDate = accountLatestDate
-
-            if lastestDate < today:
-                self.pullLinkTransactions(link, str(lastestDate), str(today))
+        syncState = self.db.getSyncState()
+        plans = {}
+
+        # Find where each account and card was last synced up to
+        for link in set(self.accounts) | set(self.cards):
+            windows = []
+            linkAccounts = [(a, False) for a in self.accounts.get(link, ())] + [(c, True) for c in self.cards.get(link, ())]
+
+            for account_id, card in linkAccounts:
+                highWater = syncState.get(account_id, (None, None))[0]
+                if not highWater:
+                    last = self.db.getLastTransaction(account_id)
+                    highWater = last['timestamp'] if last else str(today - timedelta(days=initial_days))
+
+                highWater = datetime.strptime(highWater, '%Y-%m-%d').date()
+                if highWater < today:
+                    windows.append((account_id, card, highWater))
+
+            if windows:
+                plans[link] = self.planLink(windows, len(linkAccounts), today)
+
+        return self.syncLinks(plans, max_workers, timeout)
+
+    def planLink(self, windows, linkAccounts, today):
+        earliest = min(highWater for _, _, highWater in windows)
+
+        # The batch endpoint re-fetches the oldest window for every account on the link,
+        # so fetch per account when the accounts are out of step with each other
+        batchDays = linkAccounts * (today - earliest).days
+        accountDays = sum((today - highWater).days + REQUEST_COST_DAYS for _, _, highWater in windows)
+
+        if accountDays < batchDays:
+            return [(account_id, card, str(highWater), str(today)) for account_id, card, highWater in windows]
+
+        return [(None, False, str(earliest), str(today))]
+
+    def syncLinks(self, plans, max_workers=4, timeout=None):
+        report = {}
+
+        # Handlers are built here since loading them touches the database
+        for link in plans:
+            self.tlHandlers[link]
+
+        # Each link's timeout runs from when a worker picks it up, not from when it was queued
+        started = {}
+
+        def fetch(link, jobs):
+            started[link] = time.monotonic()
+            deadline = started[link] + timeout if timeout is not None else None
+            return self.fetchLinkTransactions(link, jobs, deadline)
+
+        # Links are fetched concurrently, inserts stay on this thread as the single writer
+        pool = ThreadPoolExecutor(max_workers=max_workers)
+        futures = {
+            pool.submit(fetch, link, jobs): link
+            for link, jobs in plans.items()
+        }
+        pending = set(futures)
+
+        try:
+            while pending:
+                waitFor = None
+                if timeout is not None:
+                    now = time.monotonic()
+                    for future in list(pending):
+                        link = futures[future]
+                        if link in started and not future.done() and now - started[link] >= timeout:
+                            pending.discard(future)
+                            report[link] = {'status': 'timeout', 'seconds': now - started[link], 'rows': 0}
+
+                    deadlines = [started[futures[f]] + timeout - now for f in pending if futures[f] in started]
+                    waitFor = max(min(deadlines), 0) if deadlines else timeout
+
+                done, _ = wait(pending, timeout=waitFor, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.discard(future)
+                    link = futures[future]
+                    try:
+                        entries, seconds = future.result()
+                    except FetchFailed as e:
+                        report[link] = {
+                            'status': 'failed',
+                            'http_status': e.status,
+                            'error': e.error,
+                            'seconds': time.monotonic() - started[link],
+                            'rows': 0,
+                        }
+                        continue
+                    except (DeadlineExceeded, requests.Timeout) as e:
+                        report[link] = {'status': 'timeout', 'seconds': time.monotonic() - started[link], 'error': str(e), 'rows': 0}
+                        continue
+                    except Exception as e:
+                        report[link] = {'status': 'error', 'error': repr(e), 'rows': 0}
+                        continue
+
+                    report[link] = {'status': 'ok', 'seconds': seconds, 'rows': self.storeTransactions(entries)}
+        finally:
+            # Fetches give up at their deadline, this only waits for requests in flight to be cut
+            # short so tokens they refreshed are queued before saving
+            pool.shutdown(wait=True, cancel_futures=True)
+
+        self.saveTokens()
+        return report
 
     def pullInitialTransactions(self, link_id, days=60):
         today = date.today()
         date_from = today - timedelta(days=days)
-        self.pullLinkTransactions(link_id, str(date_from), str(today))
+        return self.pullLinkTransactions(link_id, str(date_from), str(today))
 
     def pullLinkTransactions(self, link_id, date_from, date_to):
-        tlHandler = self.tlHandlers[link_id]
-
-        response = tlHandler.getTransactions(date_from, date_to)
-        if response.json()['status'] == 'Failed':
-            print(response.json())
+        # A PollTimeout is left to the caller, tokens refreshed before it are still saved
+        try:
+            entries, _ = self.fetchLinkTransactions(link_id, [(None, False, date_from, date_to)])
+        except FetchFailed:
             return
+        finally:
+            self.saveTokens()
+
+        return self.storeTransactions(entries)
 
-        for accountCard in ["accounts", "cards"]:
-            for account in response.json()['results'].get(accountCard, []):
-                account_id = account['account_id']
-                transactions = account['transactions']
-                
-                lastTransaction = self.db.getLastTransaction(account_id)
-                overlap_date_to = date_to if not lastTransaction else lastTransaction['timestamp']
-                overlap_date_from = datetime.strptime(date_from, '%Y-%m-%d').date() - timedelta(days=1)
-
-                overlap = {o['normalised_id'] for o in self.db.getTransactions(account_id, overlap_date_from, overlap_date_to)}
-
-                transactions = [r for r in transactions[::-1] if r.get('normalised_provider_transaction_id', r['transaction_id']) not in overlap]
-                if len(transactions) == 0:
-                    return 
-
-                if account['balance']['current'] == transactions[-1].get("running_balance", {"amount": None})["amount"]:
-                    for transaction in transactions:
-                        self.db.insertTransaction(account_id=account_id, **transaction)
-                    return
-
-                buffer = []
-                currentDate = transactions[0]['timestamp']
-
-                # Insert transactions flipping the results of each day for a contiguous ordering
-                for transaction in transactions:
-                    if transaction['timestamp'] == currentDate:
-                        buffer.append(transaction)
-                    else:
-                        for t in buffer[::-1]:
-                            self.db.insertTransaction(account_id=account_id, **t)
-                        
-                        buffer = [transaction]
-                        currentDate = transaction['timestamp']
-                for t in buffer[::-1]:
-                    self.db.insertTransaction(
-                        account_id=account_id,
-                        **t
-                    )
\ No newline at end of file
+    def fetchLinkTransactions(self, link_id, jobs, deadline=None):
+        tlHandler = self.tlHandlers[link_id]
+        tlHandler.deadline = deadline
+        try:
+            return self.fetchJobs(tlHandler, jobs)
+        finally:
+            tlHandler.deadline = None
+
+    def fetchJobs(self, tlHandler, jobs):
+        start = time.perf_counter()
+        entries = []
+
+        # A job without an account id uses the batch endpoint for the whole link
+        for account_id, card, date_from, date_to in jobs:
+            if account_id is None:
+                response = tlHandler.getTransactions(date_from, date_to)
+                if isinstance(response, str) or response.status_code != 200 or response.json()['status'] == 'Failed':
+                    raise FetchFailed.fromResponse(response)
+
+                for accountCard in ["accounts", "cards"]:
+                    for account in response.json()['results'].get(accountCard, []):
+                        balance = account.get('balance', {}).get('current')
+                        pending = account.get('pending_transactions')
+                        entries.append((account['account_id'], account['transactions'], pending, balance, date_from, date_to))
+            else:
+                response = tlHandler.getAccountTransactions(account_id, card=card, date_from=date_from, date_to=date_to)
+                if isinstance(response, str) or response.status_code != 200:
+                    raise FetchFailed.fromResponse(response)
+
+                # A failed pending request leaves the stored pending items as they are
+                pendingResponse = tlHandler.getAccountTransactions(account_id, card=card, pending=True)
+                pending = pendingResponse.json()['results'] if pendingResponse.status_code == 200 else None
+
+                entries.append((account_id, response.json()['results'], pending, None, date_from, date_to))
+
+        return entries, time.perf_counter() - start
+
+    def storeTransactions(self, entries):
+        rows = 0
+        for account_id, transactions, pending, balance, date_from, date_to in entries:
+            rows += self.storeAccountTransactions(account_id, transactions, balance)
+
+            # Stored after the settled rows so items that have cleared are matched straight away
+            if pending is not None:
+                if self.rules:
+                    self.rules.applyToTransactions(pending)
+                self.db.replacePendingTransactions(account_id, pending)
+
+            # The fetched window is complete up to date_to, the overlap picks up rows the bank posts late
+            highWater = datetime.strptime(date_to, '%Y-%m-%d').date() - timedelta(days=SYNC_OVERLAP_DAYS)
+            self.db.setSyncState(account_id, str(highWater), datetime.now().isoformat(timespec='seconds'))
+
+        return rows
+
+    def storeAccountTransactions(self, account_id, transactions, balance):
+        # Transactions already stored are ignored by the database on insert
+        transactions = transactions[::-1]
+        if len(transactions) == 0:
+            return 0
+
+        if self.rules:
+            self.rules.applyToTransactions(transactions)
+
+        # Compared in minor units, float amounts that print the same can differ in the last bit
+        running = transactions[-1].get("running_balance")
+        if balance is not None and running and toMinor(balance, running['currency']) == toMinor(running['amount'], running['currency']):
+            return self.db.insertTransactions(account_id, transactions, current_balance=balance)
+
+        ordered = []
+        buffer = []
+        currentDate = transactions[0]['timestamp']
+
+        # Insert transactions flipping the results of each day for a contiguous ordering
+        for transaction in transactions:
+            if transaction['timestamp'] == currentDate:
+                buffer.append(transaction)
+            else:
+                ordered.extend(buffer[::-1])
+
+                buffer = [transaction]
+                currentDate = transaction['timestamp']
+        ordered.extend(buffer[::-1])
+
+        return self.db.insertTransactions(account_id, ordered, current_balance=balance)
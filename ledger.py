@@ -0,0 +1,188 @@
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+FORMATS = {'parquet': 'parquet', 'arrow': 'arrow'}
+
+# Amounts are integer minor units, classifications are exported by name so ids don't leak between databases
+if pa:
+    SCHEMAS = {
+        'accounts': pa.schema([
+            ('account_id', pa.string()),
+            ('link_id', pa.int64()),
+            ('type', pa.string()),
+            ('display_name', pa.string()),
+            ('overdraft', pa.int64()),
+            ('currency', pa.string()),
+            ('account_number', pa.string()),
+            ('sort_code', pa.string()),
+            ('expired', pa.int8()),
+        ]),
+        'cards': pa.schema([
+            ('account_id', pa.string()),
+            ('link_id', pa.int64()),
+            ('type', pa.string()),
+            ('display_name', pa.string()),
+            ('credit_limit', pa.int64()),
+            ('payment_date', pa.string()),
+            ('currency', pa.string()),
+            ('card_number', pa.string()),
+            ('expired', pa.int8()),
+        ]),
+        'transactions': pa.schema([
+            ('id', pa.int64()),
+            ('normalised_id', pa.string()),
+            ('account_id', pa.string()),
+            ('timestamp', pa.string()),
+            ('amount', pa.int64()),
+            ('currency', pa.string()),
+            ('merchant_name', pa.string()),
+            ('description', pa.string()),
+            ('type', pa.string()),
+            ('category', pa.string()),
+            ('classification', pa.string()),
+            ('sub_classification', pa.string()),
+            ('balance_amount', pa.int64()),
+            ('balance_currency', pa.string()),
+            ('unstructured', pa.string()),
+        ]),
+    }
+
+EXPORT_QUERIES = {
+    'accounts': "SELECT * FROM accounts ORDER BY account_id",
+    'cards': "SELECT * FROM cards ORDER BY account_id",
+    'transactions': '''
+        SELECT
+            t.id,
+            t.normalised_id,
+            t.account_id,
+            t.timestamp,
+            t.amount,
+            t.currency,
+            t.merchant_name,
+            t.description,
+            t.type,
+            t.category,
+            c.name,
+            s.name,
+            t.balance_amount,
+            t.balance_currency,
+            t.unstructured
+        FROM transactions AS t
+        LEFT JOIN classifications AS c ON c.id = t.classification_id
+        LEFT JOIN sub_classifications AS s ON s.id = t.sub_classification_id
+        ORDER BY t.id
+    ''',
+}
+
+def requireArrow():
+    if pa is None:
+        raise ImportError("pyarrow is required to export or import the ledger")
+
+def ledgerPath(directory, table, format):
+    if format not in FORMATS:
+        raise ValueError(f"Unknown ledger format: {format}")
+    return os.path.join(directory, f"{table}.{FORMATS[format]}")
+
+def openWriter(path, schema, format):
+    if format == 'parquet':
+        return pq.ParquetWriter(path, schema)
+    return pa.ipc.new_file(path, schema)
+
+def iterBatches(path, format, batch_size):
+    if format == 'parquet':
+        yield from pq.ParquetFile(path).iter_batches(batch_size=batch_size)
+        return
+
+    with pa.memory_map(path) as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i)
+
+def exportLedger(db, directory, format='parquet', batch_size=65536):
+    requireArrow()
+    os.makedirs(directory, exist_ok=True)
+    counts = {}
+
+    # Each fetchmany becomes one row group, so memory stays at one batch whatever the ledger size
+    with db.reader() as con:
+        for table, schema in SCHEMAS.items():
+            res = con.execute(EXPORT_QUERIES[table])
+            counts[table] = 0
+
+            writer = openWriter(ledgerPath(directory, table, format), schema, format)
+            try:
+                while True:
+                    rows = res.fetchmany(batch_size)
+                    if not rows:
+                        break
+
+                    columns = [
+                        pa.array(values, type=field.type)
+                        for values, field in zip(zip(*rows), schema)
+                    ]
+                    writer.write_batch(pa.record_batch(columns, schema=schema))
+                    counts[table] += len(rows)
+            finally:
+                writer.close()
+
+    return counts
+
+def importLedger(db, directory, format='parquet', batch_size=65536):
+    requireArrow()
+    if db.cursor.execute("SELECT 1 FROM transactions LIMIT 1").fetchone():
+        raise ValueError("Ledger imports need an empty database")
+
+    counts = {}
+    try:
+        for table, schema in SCHEMAS.items():
+            path = ledgerPath(directory, table, format)
+            counts[table] = 0
+            if not os.path.exists(path):
+                continue
+
+            for batch in iterBatches(path, format, batch_size):
+                counts[table] += importBatch(db, table, schema, batch)
+
+        # Daily balances aren't exported, they're rebuilt from the imported rows
+        for account_id in db.getTransactionAccounts():
+            db.updateBalances(account_id)
+    except Exception:
+        db.con.rollback()
+        db.loadClassifications()
+        raise
+
+    db.con.commit()
+    return counts
+
+def importBatch(db, table, schema, batch):
+    columns = [batch.column(field.name).to_pylist() for field in schema]
+    rows = zip(*columns)
+
+    if table == 'transactions':
+        # Classification names are mapped back onto this database's ids
+        ids = {}
+
+        def toIds(row):
+            key = (row[10], row[11])
+            if key not in ids:
+                ids[key] = db.classificationToIds([name for name in key if name])
+            return row[:10] + ids[key] + row[12:]
+
+        rows = map(toIds, rows)
+        names = schema.names[:10] + ['classification_id', 'sub_classification_id'] + schema.names[12:]
+    else:
+        names = schema.names
+
+    db.cursor.executemany(
+        f'''
+        INSERT INTO {table} ({', '.join(names)})
+        VALUES ({','.join('?' * len(names))})
+        ''',
+        rows
+    )
+    return batch.num_rows
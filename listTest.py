@@ -1,36 +1,147 @@
 from PyQt5 import QtCore, QtGui, QtWidgets, uic
 from PyQt5.QtCore import Qt
 from database import DatabaseHandler
-import json
+from categories import CATALOGUE
+import os
 
-class Uncategorised(QtWidgets.QWidget):
-    def __init__(self, transaction):
+UI_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ui")
+
+# Each .ui file is parsed once at import, widgets then only run the generated setupUi
+UncategorisedForm, _ = uic.loadUiType(os.path.join(UI_DIR, "uncategorised.ui"))
+CategorisedForm, _ = uic.loadUiType(os.path.join(UI_DIR, "categorised.ui"))
+EditTransactionForm, _ = uic.loadUiType(os.path.join(UI_DIR, "transactionEditDialog.ui"))
+MainWindowForm, _ = uic.loadUiType(os.path.join(UI_DIR, "transactionList.ui"))
+
+# Columns kept per row in the list model
+ROW_COLUMNS = ('id', 'timestamp', 'merchant_name', 'description', 'amount', 'classification')
+TransactionRole = QtCore.Qt.UserRole + 1
+
+class Uncategorised(QtWidgets.QWidget, UncategorisedForm):
+    def __init__(self):
         super(Uncategorised, self).__init__()
-        uic.loadUi("ui/uncategorised.ui", self)
+        self.setupUi(self)
 
+    def setTransaction(self, transaction):
         self.date.setText(transaction['timestamp'])
         self.description.setText(transaction['description'])
         self.amount.setText(f"£ {transaction['amount']:,.2f}")
 
-class Categorised(QtWidgets.QWidget):
-    def __init__(self, transaction):
+class Categorised(QtWidgets.QWidget, CategorisedForm):
+    def __init__(self):
         super(Categorised, self).__init__()
-        uic.loadUi("ui/categorised.ui", self)
+        self.setupUi(self)
 
+    def setTransaction(self, transaction):
         self.date.setText(transaction['timestamp'])
         self.merchantName.setText(transaction['merchant_name'])
         self.amount.setText(f"£ {transaction['amount']:,.2f}")
 
-        if transaction['classification']:
-            cat1, cat2 = transaction['classification']
-            self.category.setText(cat1)
-            self.subcategory.setText(cat2)
-
-
-class EditTransactionDialog(QtWidgets.QDialog):
+        cat1, cat2 = transaction['classification'] or ("", "")
+        self.category.setText(cat1)
+        self.subcategory.setText(cat2)
+
+
+class TransactionModel(QtCore.QAbstractListModel):
+    def __init__(self, db, account_id, date_from=None, date_to=None, page_size=200):
+        super(TransactionModel, self).__init__()
+        self.db = db
+        self.account_id = account_id
+        self.date_from = date_from
+        self.date_to = date_to
+        self.page_size = page_size
+
+        self.rows = []
+        self.exhausted = False
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        row = self.rows[index.row()]
+        if role == Qt.UserRole:
+            return row[0]
+        if role == TransactionRole:
+            return dict(zip(ROW_COLUMNS, row))
+        if role == Qt.DisplayRole:
+            return row[2] or row[3]
+        return None
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and not self.exhausted
+
+    def fetchMore(self, parent):
+        # Keyset pagination from the last (timestamp, id) loaded, newest first
+        after = (self.rows[-1][1], self.rows[-1][0]) if self.rows else None
+        page = [
+            tuple(t[c] for c in ROW_COLUMNS)
+            for t in self.db.iterTransactions(
+                self.account_id,
+                self.date_from,
+                self.date_to,
+                columns=ROW_COLUMNS,
+                after=after,
+                descending=True,
+                limit=self.page_size
+            )
+        ]
+
+        if len(page) < self.page_size:
+            self.exhausted = True
+        if not page:
+            return
+
+        self.beginInsertRows(QtCore.QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+        self.rows.extend(page)
+        self.endInsertRows()
+
+    def setTransaction(self, row, transaction):
+        self.setTransactions({row: transaction})
+
+    def setTransactions(self, transactions):
+        for row, transaction in transactions.items():
+            self.rows[row] = tuple(transaction[c] for c in ROW_COLUMNS)
+
+        # One signal covering every changed row so the view repaints once
+        if transactions:
+            self.dataChanged.emit(self.index(min(transactions)), self.index(max(transactions)))
+
+
+class TransactionDelegate(QtWidgets.QStyledItemDelegate):
+    def __init__(self, parent=None):
+        super(TransactionDelegate, self).__init__(parent)
+
+        # One template widget per row type is filled in and rendered for every visible row
+        self.categorised = Categorised()
+        self.uncategorised = Uncategorised()
+
+    def template(self, transaction):
+        widget = self.categorised if transaction['merchant_name'] else self.uncategorised
+        widget.setTransaction(transaction)
+        return widget
+
+    def paint(self, painter, option, index):
+        style = option.widget.style() if option.widget else QtWidgets.QApplication.style()
+        style.drawPrimitive(QtWidgets.QStyle.PE_PanelItemViewItem, option, painter, option.widget)
+
+        widget = self.template(index.data(TransactionRole))
+        widget.resize(option.rect.size())
+
+        painter.save()
+        painter.translate(option.rect.topLeft())
+        widget.render(painter, QtCore.QPoint(0, 0), QtGui.QRegion(), QtWidgets.QWidget.DrawChildren)
+        painter.restore()
+
+    def sizeHint(self, option, index):
+        return self.template(index.data(TransactionRole)).sizeHint()
+
+
+class EditTransactionDialog(QtWidgets.QDialog, EditTransactionForm):
     def __init__(self, row, transaction, listView):
         super(EditTransactionDialog, self).__init__()
-        uic.loadUi("ui/transactionEditDialog.ui", self)
+        self.setupUi(self)
 
         self.row = row
         self.listView = listView
@@ -41,12 +152,7 @@ class EditTransactionDialog(QtWidgets.QDialog):
         self.description.setText(transaction['description'])
         self.amount.setText(f"£ {transaction['amount']:,.2f}")
 
-        with open("categories.json", "r") as f:
-            self.categoryData = json.load(f)
-        self.mainCategories = [cat["classification_category"] for cat in self.categoryData]
-        self.mainCategories.insert(0, "")
-
-        self.mainCategory.addItems(self.mainCategories)
+        self.mainCategory.addItems(("",) + CATALOGUE.categories)
         
         if transaction['classification']:
             main, sub = transaction['classification']
@@ -58,20 +164,14 @@ class EditTransactionDialog(QtWidgets.QDialog):
         self.buttonBox.accepted.connect(self.accepted)
 
     def setComboBoxCategory(self, category):
-        index = self.mainCategories.index(category)
-
-        self.mainCategory.setCurrentIndex(index)
+        self.mainCategory.setCurrentIndex(CATALOGUE.categoryIndex(category))
 
-        subs = [""] + self.categoryData[index-1]["sub_classification_categories"]
         self.subCategory.clear()
-        self.subCategory.addItems(subs)
+        self.subCategory.addItems(("",) + CATALOGUE.subCategories.get(category, ()))
 
     def setComboBoxSubCategory(self, sub):
-        index = self.mainCategory.currentIndex()
-        subs = self.categoryData[index-1]["sub_classification_categories"]
-
-        index = subs.index(sub)
-        self.subCategory.setCurrentIndex(index+1)
+        category = self.mainCategory.currentText()
+        self.subCategory.setCurrentIndex(CATALOGUE.subCategoryIndex(category, sub))
 
     def accepted(self):
         mainCat = self.mainCategory.currentText()
@@ -86,53 +186,33 @@ class EditTransactionDialog(QtWidgets.QDialog):
 
         self.listView.updateRow(self.row, update)
 
-class MainWindow(QtWidgets.QMainWindow):
+class MainWindow(QtWidgets.QMainWindow, MainWindowForm):
     def __init__(self):
         QtWidgets.QMainWindow.__init__(self)
-        uic.loadUi("ui/transactionList.ui", self)
+        self.setupUi(self)
         
         self.editButton.clicked.connect(self.editClick)
 
         self.db = DatabaseHandler("test.db")
         account_id = self.db.getAccounts()[0]['account_id']
-        transactions = self.db.getTransactions(account_id, "2022-08-01", "2022-08-31")
-
-        for transaction in transactions[::-1]:
-            self.addTransaction(transaction)
 
-
-    def addTransaction(self, transaction, row=-1):
-        if transaction['merchant_name']:
-            object =  Categorised(transaction)
-        else:
-            object =  Uncategorised(transaction)
-
-        item = QtWidgets.QListWidgetItem()
-        item.setData(QtCore.Qt.UserRole, transaction['id'])
-        item.setSizeHint(object.sizeHint())
-
-        if row == -1:
-            self.transactionListWidget.addItem(item)
-            self.transactionListWidget.setItemWidget(item, object)
-        else:
-            print(row)
-            self.transactionListWidget.insertItem(row, item)
-            self.transactionListWidget.setItemWidget(item, object)
+        self.model = TransactionModel(self.db, account_id, "2022-08-01", "2022-08-31")
+        self.transactionListView.setModel(self.model)
+        self.transactionListView.setItemDelegate(TransactionDelegate(self.transactionListView))
     
     def updateRow(self, row, update):
-        print(row, update)
-        self.transactionListWidget.takeItem(row)
-        self.db.updateTransaction(**update)
-        transaction = self.db.getTransaction(id=update['id'])
-        self.addTransaction(transaction, row=row)
-        self.transactionListWidget.setCurrentRow(row)
+        self.updateRows({row: update})
+
+    def updateRows(self, updates):
+        rows = list(updates)
+        transactions = self.db.updateTransactions([updates[row] for row in rows])
+        self.model.setTransactions({row: t for row, t in zip(rows, transactions) if t})
 
     def editClick(self):
-        listWidget = self.transactionListWidget
-        selected = listWidget.selectedItems()
-        if selected:
-            row = listWidget.currentRow()
-            id = selected[0].data(QtCore.Qt.UserRole)
+        index = self.transactionListView.currentIndex()
+        if index.isValid():
+            row = index.row()
+            id = index.data(QtCore.Qt.UserRole)
             transaction = self.db.getTransaction(id = id)
 
             self.dialog = EditTransactionDialog(row, transaction, self)
@@ -140,7 +220,8 @@ class MainWindow(QtWidgets.QMainWindow):
             
 
 
-app = QtWidgets.QApplication([])
-window = MainWindow()
-window.show()
-app.exec_()
\ No newline at end of file
+if __name__ == '__main__':
+    app = QtWidgets.QApplication([])
+    window = MainWindow()
+    window.show()
+    app.exec_()
\ No newline at end of file
@@ -0,0 +1,30 @@
+from decimal import Decimal, ROUND_HALF_EVEN
+
+# ISO 4217 minor unit digits, currencies not listed have two
+EXPONENTS = {
+    'BIF': 0, 'CLP': 0, 'DJF': 0, 'GNF': 0, 'ISK': 0, 'JPY': 0, 'KMF': 0, 'KRW': 0,
+    'PYG': 0, 'RWF': 0, 'UGX': 0, 'VND': 0, 'VUV': 0, 'XAF': 0, 'XOF': 0, 'XPF': 0,
+    'BHD': 3, 'IQD': 3, 'JOD': 3, 'KWD': 3, 'LYD': 3, 'OMR': 3, 'TND': 3,
+}
+
+def exponent(currency):
+    return EXPONENTS.get(currency, 2)
+
+def toDecimal(amount):
+    # Floats go through their shortest repr so 0.1 stays 0.1
+    return Decimal(repr(amount)) if isinstance(amount, float) else Decimal(amount)
+
+def toMinor(amount, currency=None):
+    if amount is None:
+        return None
+    return int(toDecimal(amount).scaleb(exponent(currency)).to_integral_value(ROUND_HALF_EVEN))
+
+def fromMinor(minor, currency=None):
+    if minor is None:
+        return None
+    return toDecimal(minor).scaleb(-exponent(currency))
+
+def minorSql(column, currency):
+    # Used by the migration to rescale stored floats inside SQLite
+    cases = " ".join(f"WHEN '{code}' THEN {10 ** digits}" for code, digits in EXPONENTS.items())
+    return f"CAST(ROUND({column} * CASE {currency} {cases} ELSE 100 END) AS INTEGER)"
@@ -0,0 +1,94 @@
+from collections import namedtuple
+
+from money import fromMinor
+
+# Stored as integer minor units, each scaled by the currency in the paired field
+AMOUNT_FIELDS = {
+    'amount': 'currency',
+    'balance_amount': 'balance_currency',
+    'overdraft': 'currency',
+    'credit_limit': 'currency',
+}
+
+class Record:
+    __slots__ = ()
+
+    # String keys read fields by name, so records work where dicts were used before
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return tuple.__getitem__(self, self._positions[key])
+        return tuple.__getitem__(self, key)
+
+    def __contains__(self, key):
+        return key in self._positions
+
+    def get(self, key, default=None):
+        position = self._positions.get(key)
+        return default if position is None else tuple.__getitem__(self, position)
+
+    def keys(self):
+        return self._fields
+
+def record(name, fields):
+    cls = type(name, (Record, namedtuple(name, fields)), {'__slots__': ()})
+    cls._positions = {field: i for i, field in enumerate(fields)}
+    return cls
+
+Account = record('Account', (
+    'account_id', 'link_id', 'type', 'display_name', 'overdraft',
+    'currency', 'account_number', 'sort_code', 'expired',
+))
+
+Card = record('Card', (
+    'account_id', 'link_id', 'type', 'display_name', 'credit_limit',
+    'payment_date', 'currency', 'card_number', 'expired',
+))
+
+Transaction = record('Transaction', (
+    'id', 'normalised_id', 'account_id', 'timestamp', 'amount', 'currency',
+    'merchant_name', 'description', 'type', 'category', 'classification',
+    'balance_amount', 'balance_currency', 'unstructured',
+))
+
+SearchResult = record('SearchResult', Transaction._fields + ('rank',))
+
+PendingTransaction = record('PendingTransaction', (
+    'id', 'normalised_id', 'account_id', 'timestamp', 'amount', 'currency',
+    'merchant_name', 'description', 'type', 'category', 'classification', 'settled_id',
+))
+
+class RowFactory:
+    def __init__(self, record, classificationFromIds=None):
+        self.record = record
+        self.classificationFromIds = classificationFromIds
+        self.description = None
+
+    def plan(self, description):
+        # Worked out once per statement, rows then just copy values into place
+        positions = {column[0]: i for i, column in enumerate(description)}
+        fields = self.record._fields
+
+        self.description = description
+        self.columns = [positions.get(field) for field in fields]
+        self.amounts = [
+            (i, positions.get(AMOUNT_FIELDS[field]))
+            for i, field in enumerate(fields)
+            if field in AMOUNT_FIELDS and field in positions
+        ]
+        self.classification = None
+        if 'classification' in fields and 'classification_id' in positions:
+            self.classification = (fields.index('classification'), positions['classification_id'])
+
+    def __call__(self, cursor, row):
+        if cursor.description is not self.description:
+            self.plan(cursor.description)
+
+        values = [None if i is None else row[i] for i in self.columns]
+        for i, currency in self.amounts:
+            if values[i] is not None:
+                values[i] = fromMinor(values[i], None if currency is None else row[currency])
+        if self.classification:
+            field, column = self.classification
+            values[field] = self.classificationFromIds(row[column], row[column + 1], cursor.connection)
+
+        return tuple.__new__(self.record, values)
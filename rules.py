@@ -0,0 +1,138 @@
+import re
+from functools import lru_cache
+
+from categories import CATALOGUE
+
+KINDS = ('exact', 'prefix', 'regex')
+FIELDS = ('merchant_name', 'description')
+
+class RulesEngine:
+    def __init__(self, dbHandler):
+        self.db = dbHandler
+        self.compile()
+
+    def addRule(self, kind, pattern, category, sub_category, field='merchant_name'):
+        return self.addRules([(kind, pattern, category, sub_category, field)])[0]
+
+    def addRules(self, rules):
+        # rules are (kind, pattern, category, sub_category[, field]), stored together and compiled once
+        rules = [(*rule, 'merchant_name') if len(rule) == 4 else tuple(rule) for rule in rules]
+        added = {field: [] for field in FIELDS}
+        for i, (kind, pattern, category, sub_category, field) in enumerate(rules):
+            if kind not in KINDS:
+                raise ValueError(f"Unknown rule kind: {kind}")
+            if field not in FIELDS:
+                raise ValueError(f"Unknown rule field: {field}")
+            CATALOGUE.validate([category, sub_category])
+
+            if kind != 'exact':
+                added[field].append(self.alternative(f"new{i}", kind, pattern))
+
+        # A pattern can compile alone and still break the shared alternation, e.g. inline global flags
+        for field, parts in added.items():
+            if parts:
+                self.combine(self.alternatives[field] + parts)
+
+        rule_ids = self.db.addRules([
+            (kind, field, pattern, category, sub_category)
+            for kind, pattern, category, sub_category, field in rules
+        ])
+        self.compile()
+        return rule_ids
+
+    def deleteRule(self, rule_id):
+        self.db.deleteRule(rule_id)
+        self.compile()
+
+    def alternative(self, rule_id, kind, pattern):
+        if kind == 'prefix':
+            return f"(?P<r{rule_id}>^{re.escape(pattern)})"
+        return f"(?P<r{rule_id}>{pattern})"
+
+    def combine(self, parts):
+        return re.compile("|".join(parts), re.IGNORECASE) if parts else None
+
+    def compile(self):
+        self.exact = {field: {} for field in FIELDS}
+        self.alternatives = alternatives = {field: [] for field in FIELDS}
+        self.classifications = {}
+        self.decoded = {}
+
+        # Exact rules are a dict lookup, prefix and regex rules share one alternation per field
+        # Matches are classification ids, so history can be compared without decoding rows
+        for rule_id, kind, field, pattern, category, sub_category in self.db.getRules():
+            encoded = self.db.classificationToIds([category, sub_category])
+            self.decoded[encoded] = [category, sub_category]
+
+            if kind == 'exact':
+                self.exact[field].setdefault(pattern.casefold(), encoded)
+                continue
+
+            self.classifications[f"r{rule_id}"] = encoded
+            alternatives[field].append(self.alternative(rule_id, kind, pattern))
+
+        self.patterns = {field: self.combine(parts) for field, parts in alternatives.items()}
+        self.match = lru_cache(maxsize=65536)(self.matchUncached)
+        self.db.con.commit()
+
+    def matchUncached(self, merchant_name, description):
+        for field, value in zip(FIELDS, (merchant_name, description)):
+            if not value:
+                continue
+
+            classification = self.exact[field].get(value.casefold())
+            if classification:
+                return classification
+
+            pattern = self.patterns[field]
+            match = pattern.search(value) if pattern else None
+            if match:
+                return self.classifications[match.lastgroup]
+
+        return None
+
+    def classify(self, transaction):
+        encoded = self.match(transaction.get('merchant_name'), transaction.get('description'))
+        return list(self.decoded[encoded]) if encoded else None
+
+    def applyToTransactions(self, transactions):
+        # Used at ingest, only fills in transactions the provider left unclassified
+        for transaction in transactions:
+            if transaction.get('transaction_classification'):
+                continue
+
+            classification = self.classify(transaction)
+            if classification:
+                transaction['transaction_classification'] = classification
+
+        return transactions
+
+    def applyToHistory(self, account_ids=None, overwrite=False):
+        conditions = []
+        params = []
+        if account_ids:
+            account_ids = [account_ids] if isinstance(account_ids, str) else list(account_ids)
+            conditions.append(f"account_id IN ({','.join('?' * len(account_ids))})")
+            params += account_ids
+        if not overwrite:
+            conditions.append("classification_id IS NULL")
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        res = self.db.con.cursor().execute(
+            f'''
+            SELECT id, account_id, timestamp, amount, classification_id, sub_classification_id, merchant_name, description
+            FROM transactions
+            {where}
+            ''',
+            params
+        )
+
+        changes = []
+        for row in res:
+            encoded = self.match(row[6], row[7])
+            if encoded and encoded != row[4:6]:
+                old = (*row[:4], self.db.classificationFromIds(*row[4:6]))
+                changes.append((old, self.decoded[encoded]))
+
+        self.db.setClassifications(changes)
+        return len(changes)
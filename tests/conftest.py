@@ -0,0 +1,24 @@
+import pytest
+
+import helpers
+from database import DatabaseHandler
+from truelayer import TrueLayerHandler
+from truelayer_stub import TrueLayerStub
+
+@pytest.fixture
+def dbFile(tmp_path):
+    return str(tmp_path / "test.db")
+
+@pytest.fixture
+def db(dbFile):
+    handler = DatabaseHandler(dbFile)
+    yield handler
+    handler.close()
+
+@pytest.fixture
+def truelayer(monkeypatch):
+    stub = TrueLayerStub()
+    monkeypatch.setattr(TrueLayerHandler, 'base_url', stub.url)
+    monkeypatch.setattr(TrueLayerHandler, 'auth_url', f"{stub.url}/connect/token")
+    yield stub
+    stub.close()
@@ -0,0 +1,21 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def makeTransaction(i, timestamp='2022-08-01', amount=-1.5, currency='GBP', merchant_name=None, description='card payment', classification=None, running_balance=None):
+    transaction = {
+        'transaction_id': f"t{i}",
+        'normalised_provider_transaction_id': f"n{i}",
+        'timestamp': f"{timestamp}T00:00:00+00:00",
+        'amount': amount,
+        'currency': currency,
+        'merchant_name': merchant_name,
+        'description': description,
+        'transaction_type': 'DEBIT' if amount < 0 else 'CREDIT',
+        'transaction_category': 'PURCHASE',
+        'transaction_classification': classification or [],
+    }
+    if running_balance is not None:
+        transaction['running_balance'] = {'amount': running_balance, 'currency': currency}
+    return transaction
@@ -0,0 +1,85 @@
+import random
+
+import pytest
+
+from analytics import AggregateCache
+from database import DatabaseHandler
+from helpers import makeTransaction
+
+ACCOUNTS = ['a', 'b']
+MONTHS = ['2022-07', '2022-08', '2022-09']
+CLASSIFICATIONS = [None, ['Shopping', 'Groceries'], ['Entertainment', 'Music'], ['Entertainment', 'Arts']]
+
+def recompute(db):
+    totals = {}
+    for account_id in ACCOUNTS:
+        for t in db.getTransactions(account_id):
+            key = (account_id, t['timestamp'][:7], t['classification'][0] if t['classification'] else None)
+            total, count = totals.get(key, (0, 0))
+            totals[key] = (total + int(t['amount'] * 100), count + 1)
+    return totals
+
+def randomTransaction(rng, i):
+    return makeTransaction(
+        i,
+        timestamp=f"{rng.choice(MONTHS)}-{rng.randint(1, 28):02d}",
+        amount=rng.randint(-5000, 5000) / 100,
+        classification=rng.choice(CLASSIFICATIONS),
+    )
+
+@pytest.mark.parametrize('persistent', [False, True])
+def test_cache_matches_full_recompute(dbFile, persistent):
+    rng = random.Random(13)
+    db = DatabaseHandler(dbFile)
+    other = DatabaseHandler(dbFile)
+
+    # Every classification is known to both handlers before they start writing
+    db.insertTransactions('a', [makeTransaction(0, classification=c) for c in CLASSIFICATIONS if c])
+    other.loadClassifications()
+
+    cache = AggregateCache(db, persistent=persistent)
+    keys = [(a, m, c[0] if c else None) for a in ACCOUNTS for m in MONTHS for c in CLASSIFICATIONS]
+
+    try:
+        i = 100
+        for round in range(20):
+            # Writes alternate between the cache's own handler and one it can't observe
+            writer = db if round % 2 else other
+            for account_id in ACCOUNTS:
+                batch = [randomTransaction(rng, i + n) for n in range(rng.randint(1, 10))]
+                i += len(batch)
+                writer.insertTransactions(account_id, batch)
+
+            rows = writer.getTransactions(rng.choice(ACCOUNTS))
+            writer.updateTransactions([
+                {
+                    'id': t['id'],
+                    'merchant_name': t['merchant_name'],
+                    'description': t['description'],
+                    'classification': rng.choice(CLASSIFICATIONS) or [],
+                }
+                for t in rng.sample(rows, min(3, len(rows)))
+            ])
+
+            expected = recompute(db)
+            for key in keys:
+                # Read in random order so some entries are cached before the next round's deltas
+                if rng.random() < 0.5:
+                    assert cache.get(*key) == expected.get(key, (0, 0)), key
+    finally:
+        other.close()
+        db.close()
+
+def test_persistent_table_tracks_writes_without_a_cache(dbFile):
+    db = DatabaseHandler(dbFile)
+    AggregateCache(db, persistent=True)
+    db.close()
+
+    db = DatabaseHandler(dbFile)
+    db.insertTransactions('a', [makeTransaction(1, amount=-2), makeTransaction(2, amount=-3)])
+    row = db.con.execute(
+        "SELECT total, count FROM category_totals WHERE account_id = 'a' AND month = '2022-08'"
+    ).fetchone()
+    db.close()
+
+    assert row == (-500, 2)
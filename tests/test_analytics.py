@@ -0,0 +1,29 @@
+from decimal import Decimal
+
+from analytics import Analytics
+from helpers import makeTransaction
+
+def mixedCurrencies(db):
+    db.insertTransactions('gbp', [
+        makeTransaction(1, timestamp='2022-08-01', amount=-12.5, merchant_name='Tesco', classification=['Shopping', 'Groceries']),
+        makeTransaction(2, timestamp='2022-08-02', amount=100, merchant_name='Employer'),
+    ])
+    db.insertTransactions('jpy', [
+        makeTransaction(3, timestamp='2022-08-03', amount=-1200, currency='JPY', merchant_name='Tesco', classification=['Shopping', 'Groceries']),
+    ])
+    return Analytics(db)
+
+def test_monthly_totals_are_split_by_currency(db):
+    analytics = mixedCurrencies(db)
+
+    assert analytics.monthlyTotals() == [
+        ('2022-08', Decimal('100'), Decimal('12.5'), Decimal('87.5'), 'GBP'),
+        ('2022-08', Decimal('0'), Decimal('1200'), Decimal('-1200'), 'JPY'),
+    ]
+
+def test_category_and_merchant_totals_are_split_by_currency(db):
+    analytics = mixedCurrencies(db)
+
+    assert analytics.categoryTotals() == [('Shopping', Decimal('12.5'), 1, 'GBP'), ('Shopping', Decimal('1200'), 1, 'JPY')]
+    assert analytics.topMerchants(1) == [('Tesco', Decimal('12.5'), 1, 'GBP'), ('Tesco', Decimal('1200'), 1, 'JPY')]
+    assert [(row[1], row[-1]) for row in analytics.rollingSpending()] == [(Decimal('12.5'), 'GBP'), (Decimal('1200'), 'JPY')]
@@ -0,0 +1,56 @@
+from decimal import Decimal
+
+from helpers import makeTransaction
+
+def series(db, account_id):
+    return [balance for _, balance in db.getBalanceSeries(account_id, '2022-08-01', '2022-08-31')]
+
+def test_days_before_the_first_provider_balance_are_worked_back(db):
+    db.insertTransactions('a', [
+        makeTransaction(1, timestamp='2022-08-01', amount=-5),
+        makeTransaction(2, timestamp='2022-08-02', amount=-5),
+        makeTransaction(3, timestamp='2022-08-03', amount=-5, running_balance=100),
+    ])
+
+    assert series(db, 'a') == [110, 105, 100]
+
+def test_provider_balances_win_over_the_running_sum(db):
+    db.insertTransactions('a', [
+        makeTransaction(1, timestamp='2022-08-01', amount=-5, running_balance=95),
+        makeTransaction(2, timestamp='2022-08-02', amount=-5),
+        makeTransaction(3, timestamp='2022-08-03', amount=10, running_balance=120),
+        makeTransaction(4, timestamp='2022-08-04', amount=-20),
+    ])
+
+    assert series(db, 'a') == [95, 90, 120, 100]
+
+def test_incremental_and_late_posted_rows(db):
+    # Without provider balances the series is anchored on the current balance
+    db.insertTransactions('a', [
+        makeTransaction(1, timestamp='2022-08-01', amount=-5),
+        makeTransaction(2, timestamp='2022-08-02', amount=-5),
+        makeTransaction(3, timestamp='2022-08-04', amount=20),
+    ], current_balance=50)
+    assert db.getBalanceSeries('a', '2022-08-01', '2022-08-31') == [
+        ('2022-08-01', 35), ('2022-08-02', 30), ('2022-08-04', 50),
+    ]
+
+    db.insertTransactions('a', [makeTransaction(4, timestamp='2022-08-05', amount=-10)])
+    assert series(db, 'a') == [35, 30, 50, 40]
+
+    # A row posted late for an earlier day moves every balance from that day on
+    db.insertTransactions('a', [makeTransaction(5, timestamp='2022-08-02', amount=-3)])
+    assert series(db, 'a') == [35, 27, 47, 37]
+
+    assert db.getBalance('a') == (Decimal('37'), 'GBP')
+    assert db.getBalance('a', '2022-08-03') == (Decimal('27'), 'GBP')
+    assert db.getBalance('a', '2022-07-31') is None
+    assert db.getBalanceSeries('a', '2022-08-02', '2022-08-04') == [('2022-08-02', 27), ('2022-08-04', 47)]
+
+def test_rebuild_matches_incremental_ingest(db):
+    for i, amount in enumerate([-5, 12.5, -7.25, -1]):
+        db.insertTransactions('a', [makeTransaction(i, timestamp=f"2022-08-{i * 2 + 1:02d}", amount=amount)])
+    incremental = series(db, 'a')
+
+    db.rebuildBalances('a')
+    assert series(db, 'a') == incremental == [Decimal('-5'), Decimal('7.5'), Decimal('0.25'), Decimal('-0.75')]
@@ -0,0 +1,120 @@
+import statistics
+import threading
+import time
+from datetime import date, timedelta
+
+from database import DatabaseHandler
+from helpers import makeTransaction
+
+ROWS = 100000
+BATCH = 1000
+READERS = 4
+
+def dated(i):
+    return makeTransaction(i, timestamp=str(date(2020, 1, 1) + timedelta(days=i // 100)), merchant_name=f"Shop {i % 50}")
+
+def test_readers_page_while_a_sync_writes(db):
+    db.insertTransactions('a', [dated(i) for i in range(BATCH)])
+
+    stop = threading.Event()
+    latencies = []
+    errors = []
+
+    def read():
+        while not stop.is_set():
+            try:
+                # Keyset pages through the newest rows, then a date range, like the UI does
+                after = None
+                while not stop.is_set():
+                    start = time.perf_counter()
+                    page = list(db.iterTransactions('a', columns=('id', 'timestamp', 'amount'), after=after, limit=200, descending=True))
+                    latencies.append(time.perf_counter() - start)
+                    if len(page) < 200:
+                        break
+                    after = (page[-1]['timestamp'], page[-1]['id'])
+
+                start = time.perf_counter()
+                db.getTransactions('a', '2020-01-01', '2020-01-20')
+                latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                errors.append(repr(e))
+
+    readers = [threading.Thread(target=read) for _ in range(READERS)]
+    for reader in readers:
+        reader.start()
+
+    start = time.perf_counter()
+    try:
+        for offset in range(BATCH, BATCH + ROWS, BATCH):
+            assert db.insertTransactions('a', [dated(i) for i in range(offset, offset + BATCH)]) == BATCH
+    finally:
+        stop.set()
+        for reader in readers:
+            reader.join()
+    seconds = time.perf_counter() - start
+
+    percentiles = statistics.quantiles(latencies, n=100)
+    print(
+        f"\n{ROWS} rows in {seconds:.1f}s with {READERS} readers, {len(latencies)} reads: "
+        f"p50 {percentiles[49] * 1e3:.2f}ms p95 {percentiles[94] * 1e3:.2f}ms "
+        f"p99 {percentiles[98] * 1e3:.2f}ms max {max(latencies) * 1e3:.2f}ms"
+    )
+
+    assert not errors, set(errors)
+    assert db.cursor.execute("SELECT COUNT(*) FROM transactions").fetchone()[0] == ROWS + BATCH
+
+def test_more_open_streams_than_readers(dbFile):
+    db = DatabaseHandler(dbFile, readers=2)
+    db.insertTransactions('a', [dated(i) for i in range(10)])
+    results = []
+
+    def read():
+        # Each started stream holds a reader until it's exhausted
+        streams = [db.iterTransactions('a', batch_size=2) for _ in range(5)]
+        firsts = [next(stream)['normalised_id'] for stream in streams]
+        results.append((firsts, [len(list(stream)) for stream in streams]))
+
+    reader = threading.Thread(target=read, daemon=True)
+    start = time.perf_counter()
+    reader.start()
+    reader.join(5)
+
+    try:
+        assert not reader.is_alive(), "streams deadlocked on the reader pool"
+        assert time.perf_counter() - start < 1
+        assert results == [(['n0'] * 5, [9] * 5)]
+
+        # Temporary connections are closed again, the pool keeps its size
+        assert db.readers.created == 2 and db.readers.idle.qsize() == 2
+        assert not db.readers.extra and not db.readers.held
+    finally:
+        db.close()
+
+def test_busy_pool_falls_back_after_waiting(dbFile):
+    db = DatabaseHandler(dbFile, readers=1)
+    db.readers.wait = 0.1
+    db.insertTransactions('a', [dated(i) for i in range(10)])
+
+    try:
+        held = threading.Event()
+        done = threading.Event()
+
+        def hold():
+            with db.reader():
+                held.set()
+                done.wait(5)
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        held.wait()
+
+        # Another thread's reader may come back, so this waits before opening a temporary one
+        start = time.perf_counter()
+        assert len(db.getTransactions('a')) == 10
+        assert 0.1 <= time.perf_counter() - start < 1
+
+        done.set()
+        holder.join()
+        assert db.readers.idle.qsize() == 1 and not db.readers.extra
+    finally:
+        db.close()
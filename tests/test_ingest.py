@@ -0,0 +1,27 @@
+from database import DatabaseHandler
+from helpers import makeTransaction
+
+def test_insert_counts_only_new_rows(db):
+    transactions = [makeTransaction(i, merchant_name=f"Shop {i}", classification=['Brand New', 'Category']) for i in range(10)]
+
+    assert db.insertTransactions('a', transactions) == 10
+    assert db.insertTransactions('a', transactions) == 0
+    assert db.insertTransactions('a', transactions + [makeTransaction(10)]) == 1
+    assert db.cursor.execute("SELECT COUNT(*) FROM transactions").fetchone()[0] == 11
+
+def test_insert_transaction_returns_one(db):
+    assert db.insertTransaction(account_id='a', **makeTransaction(1, merchant_name="Shop")) == 1
+    assert db.insertTransaction(account_id='a', **makeTransaction(1, merchant_name="Shop")) == 0
+
+def test_classifications_added_by_another_handler(db, dbFile):
+    other = DatabaseHandler(dbFile)
+    try:
+        other.insertTransactions('a', [makeTransaction(1, classification=['Added Elsewhere', 'Sub'])])
+
+        assert [t['classification'] for t in db.getTransactions('a')] == [['Added Elsewhere', 'Sub']]
+
+        # The existing ids are reused rather than inserted a second time
+        assert db.insertTransactions('a', [makeTransaction(2, classification=['Added Elsewhere', 'Sub'])]) == 1
+        assert db.cursor.execute("SELECT COUNT(*) FROM classifications WHERE name = 'Added Elsewhere'").fetchone()[0] == 1
+    finally:
+        other.close()
@@ -0,0 +1,74 @@
+import pytest
+
+from database import DatabaseHandler
+from helpers import makeTransaction
+
+pytest.importorskip("pyarrow")
+
+import ledger
+
+TRANSACTIONS_QUERY = '''
+    SELECT
+        t.id,
+        t.normalised_id,
+        t.account_id,
+        t.timestamp,
+        t.amount,
+        t.currency,
+        t.merchant_name,
+        t.description,
+        t.type,
+        t.category,
+        c.name,
+        s.name,
+        t.balance_amount,
+        t.balance_currency
+    FROM transactions AS t
+    LEFT JOIN classifications AS c ON c.id = t.classification_id
+    LEFT JOIN sub_classifications AS s ON s.id = t.sub_classification_id
+    ORDER BY t.id
+'''
+
+def contents(db):
+    return (
+        db.cursor.execute(TRANSACTIONS_QUERY).fetchall(),
+        db.cursor.execute("SELECT * FROM accounts ORDER BY account_id").fetchall(),
+        db.cursor.execute("SELECT * FROM cards ORDER BY account_id").fetchall(),
+        db.cursor.execute("SELECT * FROM daily_balances ORDER BY 1, 2").fetchall(),
+    )
+
+@pytest.mark.parametrize('format', ['parquet', 'arrow'])
+def test_ledger_round_trip(db, tmp_path, format):
+    db.cursor.execute("INSERT INTO accounts VALUES ('a', 1, 'TRANSACTION', 'Current', 10000, 'GBP', '1234', '00-00-00', 0)")
+    db.cursor.execute("INSERT INTO cards VALUES ('c', 1, 'CREDIT', 'Card', 500000, '2022-09-01', 'JPY', '4321', 1)")
+    db.con.commit()
+
+    classifications = [None, ['Shopping', 'Groceries'], ['Entertainment']]
+    db.insertTransactions('a', [
+        makeTransaction(
+            i,
+            timestamp=f"2022-08-{i % 28 + 1:02d}",
+            amount=(i - 25) / 4,
+            merchant_name=f"Shop {i % 7}" if i % 3 else None,
+            classification=classifications[i % 3],
+            running_balance=100 + i if i % 2 else None,
+        )
+        for i in range(50)
+    ])
+    db.insertTransactions('c', [makeTransaction(100 + i, amount=-1200, currency='JPY') for i in range(5)])
+    db.updateBalances('a')
+
+    directory = tmp_path / "ledger"
+    exported = ledger.exportLedger(db, directory, format, batch_size=8)
+    assert exported == {'accounts': 1, 'cards': 1, 'transactions': 55}
+
+    copy = DatabaseHandler(str(tmp_path / "copy.db"))
+    try:
+        assert ledger.importLedger(copy, directory, format, batch_size=8) == exported
+        assert contents(copy) == contents(db)
+        assert len(copy.searchTransactions('shop')) == len(db.searchTransactions('shop'))
+
+        with pytest.raises(ValueError):
+            ledger.importLedger(copy, directory, format)
+    finally:
+        copy.close()
@@ -0,0 +1,65 @@
+import sqlite3
+
+from database import DatabaseHandler, MIGRATIONS
+
+# The transactions table as it was before versioned migrations
+BASELINE_TRANSACTIONS = '''
+    CREATE TABLE `transactions` (
+        `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+        `normalised_id` VARCHAR(128),
+        `account_id` VARCHAR(32) NOT NULL,
+        `timestamp` DATE NOT NULL,
+        `amount` DECIMAL NOT NULL,
+        `currency` VARCHAR(4) NOT NULL,
+        `merchant_name` VARCHAR(128),
+        `description` TEXT,
+        `type` VARCHAR(10) NOT NULL,
+        `category` VARCHAR(64),
+        `classification` TEXT,
+        `balance_amount` DECIMAL,
+        `balance_currency` VARCHAR(4),
+        `unstructured` TEXT
+    );
+'''
+
+def baselineDatabase(file, rows):
+    con = sqlite3.connect(file)
+    con.execute(BASELINE_TRANSACTIONS)
+    con.executemany(
+        '''
+        INSERT INTO transactions (normalised_id, account_id, timestamp, amount, currency, type, classification)
+        VALUES (?,?,?,?,?,?,?)
+        ''',
+        rows
+    )
+    con.commit()
+    con.close()
+
+def test_migrations_reach_latest_version(db):
+    assert db.cursor.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+
+def test_dedup_keeps_rows_without_normalised_id(dbFile):
+    baselineDatabase(dbFile, [
+        *[(None, 'a', '2022-08-01', -1.5, 'GBP', 'DEBIT', None) for _ in range(5)],
+        ('n1', 'a', '2022-08-01', -2.0, 'GBP', 'DEBIT', None),
+        ('n1', 'a', '2022-08-01', -2.0, 'GBP', 'DEBIT', None),
+    ])
+
+    db = DatabaseHandler(dbFile)
+    rows = db.cursor.execute("SELECT normalised_id, amount FROM transactions ORDER BY id").fetchall()
+    db.close()
+
+    assert rows == [(None, -150)] * 5 + [('n1', -200)]
+
+def test_migration_converts_money_and_classifications(dbFile):
+    baselineDatabase(dbFile, [
+        ('n1', 'a', '2022-08-01', -65.69, 'GBP', 'DEBIT', '["Shopping", "Groceries"]'),
+        ('n2', 'j', '2022-08-01', 1500, 'JPY', 'CREDIT', None),
+    ])
+
+    db = DatabaseHandler(dbFile)
+    transactions = db.getTransactions(['a', 'j'])
+    db.close()
+
+    assert [str(t['amount']) for t in transactions] == ['-65.69', '1500']
+    assert [t['classification'] for t in transactions] == [['Shopping', 'Groceries'], []]
@@ -0,0 +1,83 @@
+from helpers import makeTransaction
+
+def pending(i, **kwargs):
+    transaction = makeTransaction(i, **kwargs)
+    transaction['normalised_provider_transaction_id'] = f"p{i}"
+    return transaction
+
+def settledIds(db, account_id='a'):
+    ids = dict(db.cursor.execute("SELECT id, normalised_id FROM transactions").fetchall())
+    return {
+        t['normalised_id']: ids.get(t['settled_id'])
+        for t in db.getPendingTransactions(account_id, include_settled=True)
+    }
+
+def test_provider_id_is_matched_first(db):
+    # The settled row's amount changed and it posted outside the tolerance, the other row is a closer fit
+    db.insertTransactions('a', [
+        makeTransaction(1, timestamp='2022-08-15', amount=-5.5),
+        makeTransaction(2, timestamp='2022-08-10', amount=-5),
+    ])
+    transaction = pending(1, timestamp='2022-08-10', amount=-5)
+    transaction['normalised_provider_transaction_id'] = 'n1'
+
+    assert db.replacePendingTransactions('a', [transaction]) == 0
+    assert settledIds(db) == {'n1': 'n1'}
+
+def test_amount_is_matched_within_the_date_tolerance(db):
+    db.insertTransactions('a', [
+        makeTransaction(1, timestamp='2022-08-13', amount=-7),
+        makeTransaction(2, timestamp='2022-08-14', amount=-8),
+        makeTransaction(3, timestamp='2022-08-10', amount=-9.01),
+    ])
+
+    unmatched = db.replacePendingTransactions('a', [
+        pending(1, timestamp='2022-08-10', amount=-7),
+        pending(2, timestamp='2022-08-10', amount=-8),
+        pending(3, timestamp='2022-08-10', amount=-9),
+    ], tolerance_days=3)
+
+    # Three days out matches, four days out or a different amount doesn't
+    assert unmatched == 2
+    assert settledIds(db) == {'p1': 'n1', 'p2': None, 'p3': None}
+    assert [t['normalised_id'] for t in db.getPendingTransactions('a')] == ['p3', 'p2']
+
+def test_merchant_has_to_agree(db):
+    db.insertTransactions('a', [
+        makeTransaction(1, timestamp='2022-08-10', amount=-9, merchant_name='Sainsbury'),
+        makeTransaction(2, timestamp='2022-08-11', amount=-9, merchant_name='TESCO'),
+        makeTransaction(3, timestamp='2022-08-10', amount=-4, merchant_name='Boots'),
+        makeTransaction(4, timestamp='2022-08-12', amount=-4),
+    ])
+
+    db.replacePendingTransactions('a', [
+        pending(1, timestamp='2022-08-10', amount=-9, merchant_name='Tesco'),
+        pending(2, timestamp='2022-08-10', amount=-4, merchant_name='Superdrug'),
+    ])
+
+    # Merchants compare without case, a row without a merchant can match any
+    assert settledIds(db) == {'p1': 'n2', 'p2': 'n4'}
+
+def test_settled_rows_are_claimed_once(db):
+    db.insertTransactions('a', [makeTransaction(1, timestamp='2022-08-10', amount=-3)])
+    items = [pending(i, timestamp='2022-08-10', amount=-3) for i in (1, 2)]
+
+    assert db.replacePendingTransactions('a', items) == 1
+    assert settledIds(db) == {'p1': 'n1', 'p2': None}
+
+    # Once its own row settles, the second item matches that one instead of sharing the first
+    db.insertTransactions('a', [makeTransaction(2, timestamp='2022-08-11', amount=-3)])
+    assert db.replacePendingTransactions('a', items) == 0
+    assert settledIds(db) == {'p1': 'n1', 'p2': 'n2'}
+
+def test_resync_replaces_the_pending_list(db):
+    db.replacePendingTransactions('a', [pending(1), pending(2)])
+    db.replacePendingTransactions('a', [pending(2), pending(3)])
+    db.replacePendingTransactions('b', [pending(4)])
+
+    assert sorted(settledIds(db)) == ['p2', 'p3']
+    assert len(db.getPendingTransactions('a')) == 2
+
+    db.replacePendingTransactions('a', [])
+    assert db.getPendingTransactions('a') == []
+    assert settledIds(db, 'b') == {'p4': None}
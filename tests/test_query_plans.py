@@ -0,0 +1,38 @@
+import pytest
+
+from database import DatabaseHandler
+from helpers import makeTransaction
+
+@pytest.fixture
+def memoryDb():
+    db = DatabaseHandler(":memory:")
+    db.insertTransactions('a', [makeTransaction(i, f"2022-08-{i % 28 + 1:02}") for i in range(200)])
+    yield db
+    db.close()
+
+def plansFor(db, call):
+    # Statements are captured with their bound values, then explained
+    statements = []
+    db.con.set_trace_callback(statements.append)
+    try:
+        call()
+    finally:
+        db.con.set_trace_callback(None)
+
+    plans = []
+    for sql in statements:
+        if sql.lstrip().upper().startswith("SELECT"):
+            plans += [row[3] for row in db.con.execute(f"EXPLAIN QUERY PLAN {sql}")]
+    assert plans
+    return plans
+
+@pytest.mark.parametrize("call", [
+    lambda db: db.getLastTransaction('a'),
+    lambda db: db.getTransaction(normalised_id='n10'),
+    lambda db: db.getTransaction(id=10),
+    lambda db: list(db.iterTransactions('a', '2022-08-03', '2022-08-09')),
+    lambda db: list(db.iterTransactions(['a', 'b'], after=('2022-08-10', 50), descending=True, limit=20)),
+], ids=['last', 'normalised_id', 'id', 'range', 'keyset'])
+def test_reads_use_indexes(memoryDb, call):
+    plans = plansFor(memoryDb, lambda: call(memoryDb))
+    assert not [plan for plan in plans if plan.startswith("SCAN")], plans
@@ -0,0 +1,62 @@
+import re
+
+import pytest
+
+from helpers import makeTransaction
+from rules import RulesEngine
+
+def test_rules_classify_by_kind(db):
+    engine = RulesEngine(db)
+    engine.addRule('exact', 'tesco', 'Shopping', 'Groceries')
+    engine.addRule('prefix', 'spot', 'Entertainment', 'Music')
+    engine.addRule('regex', r'al+di', 'Shopping', 'Groceries', field='description')
+
+    assert engine.classify({'merchant_name': 'TESCO'}) == ['Shopping', 'Groceries']
+    assert engine.classify({'merchant_name': 'Spotify Ltd'}) == ['Entertainment', 'Music']
+    assert engine.classify({'merchant_name': 'x', 'description': 'ALLDI store'}) == ['Shopping', 'Groceries']
+    assert engine.classify({'merchant_name': 'Unknown'}) is None
+
+def test_rule_breaking_the_combined_pattern_is_rejected(db):
+    engine = RulesEngine(db)
+    engine.addRule('regex', 'tesco', 'Shopping', 'Groceries')
+
+    with pytest.raises(re.error):
+        engine.addRule('regex', '(?i)amazon', 'Shopping', 'Groceries')
+
+    assert len(db.getRules()) == 1
+    assert RulesEngine(db).classify({'merchant_name': 'Tesco'}) == ['Shopping', 'Groceries']
+
+def test_apply_to_history_fills_unclassified_rows(db):
+    db.insertTransactions('a', [
+        makeTransaction(1, merchant_name='Tesco'),
+        makeTransaction(2, merchant_name='Tesco', classification=['Entertainment', 'Music']),
+        makeTransaction(3, merchant_name='Other'),
+    ])
+    engine = RulesEngine(db)
+    engine.addRule('exact', 'tesco', 'Shopping', 'Groceries')
+
+    assert engine.applyToHistory() == 1
+    assert [t['classification'] for t in db.getTransactions('a')] == [
+        ['Shopping', 'Groceries'], ['Entertainment', 'Music'], [],
+    ]
+    assert engine.applyToHistory(overwrite=True) == 1
+
+def test_add_rules_in_bulk(db):
+    engine = RulesEngine(db)
+    rule_ids = engine.addRules([
+        ('exact', 'tesco', 'Shopping', 'Groceries'),
+        ('prefix', 'spot', 'Entertainment', 'Music'),
+        ('regex', r'al+di', 'Shopping', 'Groceries', 'description'),
+    ])
+
+    assert rule_ids == [rule[0] for rule in db.getRules()]
+    assert engine.classify({'merchant_name': 'Spotify'}) == ['Entertainment', 'Music']
+    assert engine.classify({'merchant_name': 'x', 'description': 'ALDI'}) == ['Shopping', 'Groceries']
+
+    # One bad rule keeps the whole batch out
+    with pytest.raises(re.error):
+        engine.addRules([('prefix', 'pret', 'Food & Dining', 'Coffee shops'), ('regex', '(?i)amazon', 'Shopping', 'Groceries')])
+    with pytest.raises(ValueError):
+        engine.addRules([('exact', 'boots', 'Shopping', 'Groceries'), ('glob', 'x*', 'Shopping', 'Groceries')])
+
+    assert len(db.getRules()) == 3
@@ -0,0 +1,51 @@
+from helpers import makeTransaction
+
+def ids(results):
+    return [t['normalised_id'] for t in results]
+
+def checkIndex(db):
+    # rank = 1 compares the index against the transactions table itself
+    db.cursor.execute("INSERT INTO transactions_fts (transactions_fts, rank) VALUES ('integrity-check', 1)")
+
+def test_fts_follows_inserts_renames_and_deletes(db):
+    db.insertTransactions('a', [
+        makeTransaction(1, merchant_name='Pret A Manger', description='coffee'),
+        makeTransaction(2, merchant_name='Tesco', description='groceries'),
+    ])
+    checkIndex(db)
+    assert ids(db.searchTransactions('pret')) == ['n1']
+    assert ids(db.searchTransactions('groc')) == ['n2']
+
+    db.updateTransaction(id=1, merchant_name='Zebra Coffee', description='flat white', classification=[])
+    checkIndex(db)
+    assert db.searchTransactions('pret') == []
+    assert ids(db.searchTransactions('zebra flat')) == ['n1']
+
+    db.cursor.execute("DELETE FROM transactions WHERE id = 2")
+    db.con.commit()
+    checkIndex(db)
+    assert db.searchTransactions('tesco') == []
+
+def test_search_filters_give_the_same_rows_either_way(db):
+    db.insertTransactions('a', [makeTransaction(i, timestamp=f"2022-08-{i % 28 + 1:02d}", amount=-i, merchant_name='Spotify') for i in range(1, 40)])
+    db.insertTransactions('b', [makeTransaction(100 + i, timestamp='2022-08-10', merchant_name='Spotify') for i in range(5)])
+
+    # Account plus dates goes through the index first, the others filter the joined rows
+    expected = sorted(t['normalised_id'] for t in db.getTransactions(['a', 'b']) if t['account_id'] == 'a' and '2022-08-05' <= t['timestamp'] <= '2022-08-09' and t['amount'] <= -10)
+
+    filtered = db.searchTransactions('spot', page_size=100, account_ids=['a'], date_from='2022-08-05', date_to='2022-08-09', max_amount=-10)
+    assert sorted(ids(filtered)) == expected
+    assert sorted(ids(db.searchTransactions('spot', page_size=100, account_ids='b'))) == [f"n{i}" for i in range(100, 105)]
+    assert len(db.searchTransactions('spot', page_size=100, date_to='2022-08-01')) == 1
+
+def test_amount_filters_follow_each_rows_currency(db):
+    db.insertTransactions('a', [
+        makeTransaction(1, amount=-1500, currency='JPY', merchant_name='Shop'),
+        makeTransaction(2, amount=-1.5, currency='GBP', merchant_name='Shop'),
+        makeTransaction(3, amount=-0.5, currency='KWD', merchant_name='Shop'),
+    ])
+
+    for filters in ({}, {'account_ids': 'a', 'date_from': '2022-08-01'}):
+        assert ids(db.searchTransactions('shop', max_amount=-100, **filters)) == ['n1']
+        assert sorted(ids(db.searchTransactions('shop', min_amount=-2, **filters))) == ['n2', 'n3']
+        assert ids(db.searchTransactions('shop', min_amount=-0.6, max_amount=-0.4, **filters)) == ['n3']
@@ -0,0 +1,181 @@
+import time
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+from datamarshal import DataMarshaller, SYNC_OVERLAP_DAYS
+from helpers import makeTransaction
+from truelayer import DeadlineExceeded
+
+def test_high_water_follows_the_fetched_window(db):
+    marshaller = DataMarshaller(db, ip='127.0.0.1')
+    entries = [
+        ('a', [makeTransaction(1, timestamp='2022-08-01')], None, None, '2022-07-01', '2022-08-20'),
+        ('b', [], None, None, '2022-07-01', '2022-08-20'),
+    ]
+
+    assert marshaller.storeTransactions(entries) == 1
+
+    # Quiet accounts move forward too, so they aren't re-fetched from their last transaction
+    highWater = str(date(2022, 8, 20) - timedelta(days=SYNC_OVERLAP_DAYS))
+    state = db.getSyncState()
+    assert state['a'][0] == highWater
+    assert state['b'][0] == highWater
+
+def fakeSync(db, durations):
+    marshaller = DataMarshaller(db, ip='127.0.0.1')
+    saved = set()
+
+    def fetch(link, jobs, deadline):
+        # Tokens are refreshed first, then the fetch gives up at its deadline like the handlers do
+        marshaller.tokenUpdates.add(link)
+        seconds = durations[link] if deadline is None else min(durations[link], deadline - time.monotonic())
+        time.sleep(max(seconds, 0))
+        if seconds < durations[link]:
+            raise DeadlineExceeded(link)
+        return [], durations[link]
+
+    for link in durations:
+        marshaller.tlHandlers[link] = SimpleNamespace()
+    marshaller.fetchLinkTransactions = fetch
+    marshaller.saveTokens = lambda: saved.update(marshaller.tokenUpdates)
+    return marshaller, saved
+
+def test_sync_timeout_is_per_link(db):
+    durations = {'a': 0.06, 'b': 0.06, 'c': 0.06}
+    marshaller, _ = fakeSync(db, durations)
+
+    # Run one at a time, the last finishes well after the timeout but within its own
+    report = marshaller.syncLinks({link: [] for link in durations}, max_workers=1, timeout=0.1)
+
+    assert {link: r['status'] for link, r in report.items()} == {'a': 'ok', 'b': 'ok', 'c': 'ok'}
+
+def test_sync_timeout_reports_elapsed_and_keeps_tokens(db):
+    durations = {'fast': 0.01, 'slow': 2}
+    marshaller, saved = fakeSync(db, durations)
+
+    start = time.monotonic()
+    report = marshaller.syncLinks({link: [] for link in durations}, max_workers=2, timeout=0.1)
+
+    # The slow fetch stops at its deadline instead of being waited out
+    assert time.monotonic() - start < 0.5
+    assert report['fast']['status'] == 'ok'
+    assert report['slow']['status'] == 'timeout'
+    assert 0.1 <= report['slow']['seconds'] < 0.5
+
+    # The timed out fetch refreshed its token before syncLinks returned
+    assert saved == {'fast', 'slow'}
+
+def stubLinks(db, truelayer, links):
+    for link in links:
+        db.addRefreshToken(link)
+        truelayer.server.accounts[link] = [{
+            'account_id': f"{link}-account",
+            'balance': {'current': None},
+            'transactions': [makeTransaction(i, timestamp=f"2022-08-{i + 1:02d}") for i in range(3)],
+        }]
+    return DataMarshaller(db, ip='127.0.0.1', session=truelayer.session)
+
+def test_slow_link_stops_at_its_deadline(db, truelayer):
+    marshaller = stubLinks(db, truelayer, ['fast', 'slow', 'stalled'])
+
+    # One batch job never finishes in time, another link's requests stall past the timeout
+    truelayer.server.delays['fast'] = 0.05
+    truelayer.server.delays['slow'] = 10
+    truelayer.server.hangs['stalled'] = 10
+
+    jobs = [(None, False, '2022-08-01', '2022-08-31')]
+    start = time.monotonic()
+    report = marshaller.syncLinks({1: jobs, 2: jobs, 3: jobs}, timeout=0.5)
+    seconds = time.monotonic() - start
+
+    assert seconds < 1.5
+    assert report[1]['status'] == 'ok' and report[1]['rows'] == 3
+    assert report[2]['status'] == 'timeout'
+    assert report[3]['status'] == 'timeout'
+    assert countRows(db) == {'fast-account': 3}
+
+    # Tokens refreshed by every link are written back, including the ones that timed out
+    tokens = {link_id: refresh for link_id, refresh, _, _ in db.getRefreshTokens()}
+    assert tokens == {1: 'fast.refresh.1', 2: 'slow.refresh.1', 3: 'stalled.refresh.1'}
+
+    # Handlers are left without a deadline for the next sync
+    assert all(marshaller.tlHandlers[link].deadline is None for link in (1, 2, 3))
+
+class FakeResponse:
+    def __init__(self, data, status_code=200):
+        self.data = data
+        self.status_code = status_code
+
+    def json(self):
+        return self.data
+
+class BatchHandler:
+    def __init__(self, accounts):
+        self.accounts = accounts
+
+    def getTransactions(self, date_from, date_to):
+        # Newest first, as the provider returns them
+        return FakeResponse({'status': 'Succeeded', 'results': {'accounts': [
+            {'account_id': account_id, 'balance': {'current': balance}, 'transactions': transactions[::-1]}
+            for account_id, (transactions, balance) in self.accounts.items()
+        ]}})
+
+def countRows(db):
+    return dict(db.cursor.execute("SELECT account_id, COUNT(*) FROM transactions GROUP BY account_id").fetchall())
+
+def test_replayed_batch_inserts_nothing_new(db):
+    withBalance = [makeTransaction(i, timestamp=f"2022-08-{i + 1:02d}", running_balance=10 - i) for i in range(5)]
+    withoutBalance = [makeTransaction(i + 10, timestamp=f"2022-08-{i // 2 + 1:02d}") for i in range(6)]
+
+    # Rows without a normalised id are deduplicated on their transaction id
+    for transaction in withoutBalance[:2]:
+        transaction['normalised_provider_transaction_id'] = None
+
+    marshaller = DataMarshaller(db, ip='127.0.0.1')
+    marshaller.tlHandlers[1] = BatchHandler({'a': (withBalance, 6), 'b': (withoutBalance, None)})
+
+    assert marshaller.pullLinkTransactions(1, '2022-08-01', '2022-08-31') == 11
+    for _ in range(3):
+        assert marshaller.pullLinkTransactions(1, '2022-08-01', '2022-08-31') == 0
+        assert countRows(db) == {'a': 5, 'b': 6}
+
+def test_replay_with_new_rows_inserts_only_those(db):
+    transactions = [makeTransaction(i, timestamp=f"2022-08-{i + 1:02d}") for i in range(5)]
+    marshaller = DataMarshaller(db, ip='127.0.0.1')
+    marshaller.tlHandlers[1] = BatchHandler({'a': (transactions, None)})
+
+    assert marshaller.pullLinkTransactions(1, '2022-08-01', '2022-08-31') == 5
+
+    transactions.append(makeTransaction(5, timestamp='2022-08-06'))
+    for expected in (1, 0, 0):
+        assert marshaller.pullLinkTransactions(1, '2022-08-01', '2022-08-31') == expected
+
+    assert countRows(db) == {'a': 6}
+
+def test_provider_errors_go_in_the_report(db, truelayer, capsys):
+    marshaller = stubLinks(db, truelayer, ['batch', 'accounts', 'failing'])
+    truelayer.server.failed_jobs['failing'] = 'provider_error'
+    truelayer.server.transactions['good'] = [makeTransaction(1)]
+    truelayer.server.failures['blocked'] = (403, b'<html>Forbidden</html>')
+
+    window = ('2022-08-01', '2022-08-31')
+    report = marshaller.syncLinks({
+        1: [(None, False, *window)],
+        2: [('good', False, *window), ('blocked', False, *window)],
+        3: [(None, False, *window)],
+    })
+
+    assert report[1]['status'] == 'ok' and report[1]['rows'] == 3
+
+    # A non-JSON error body is reported as text, nothing is printed
+    assert report[2]['status'] == 'failed'
+    assert report[2]['http_status'] == 403
+    assert report[2]['error'] == '<html>Forbidden</html>'
+    assert report[3]['status'] == 'failed'
+    assert report[3]['http_status'] == 200
+    assert report[3]['error'] == 'provider_error'
+    assert capsys.readouterr().out == ''
+
+    # Failed links store nothing, and the direct pull still returns None
+    assert countRows(db) == {'batch-account': 3}
+    assert marshaller.pullLinkTransactions(3, *window) is None
@@ -0,0 +1,96 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from datamarshal import DataMarshaller
+from truelayer import Poller, PollTimeout, TrueLayerHandler
+
+def test_poller_returns_the_finished_response():
+    responses = iter([202, 204, 200])
+    poller = Poller(first_delay=0.001, deadline=5)
+
+    response = poller.poll(lambda: SimpleNamespace(status_code=next(responses), headers={}))
+
+    assert response.status_code == 200
+    assert poller.polls == 3
+
+def test_poller_raises_at_the_deadline():
+    poller = Poller(first_delay=0.01, deadline=0.05)
+
+    with pytest.raises(PollTimeout):
+        poller.poll(lambda: SimpleNamespace(status_code=202, headers={}))
+
+def stubHandler(truelayer, link, **kwargs):
+    return TrueLayerHandler('id', 'secret', 'uri', '127.0.0.1', refresh_token=link, session=truelayer.session, **kwargs)
+
+@pytest.mark.parametrize('job_ms', [0, 150, 600])
+def test_batch_latency_follows_the_job_time(truelayer, job_ms):
+    truelayer.server.delays['batch'] = job_ms / 1000
+    handler = stubHandler(truelayer, 'batch')
+    handler.ensureAccessToken()
+
+    start = time.monotonic()
+    response = handler.getTransactions('2022-08-01', '2022-08-31')
+    seconds = time.monotonic() - start
+
+    assert response.json()['status'] == 'Succeeded'
+
+    # Backoff overshoots the job by at most one growing poll step, not a fixed 2.5s sleep
+    assert job_ms / 1000 <= seconds < job_ms / 1000 * 1.5 + 0.15
+    assert handler.poller.waited <= seconds
+
+def test_token_is_refreshed_early_inside_the_margin(truelayer):
+    truelayer.server.valid.update({'early.access.0', 'late.access.0'})
+    early = stubHandler(truelayer, 'early', access_token='early.access.0', expires_at=time.time() + 30, refresh_margin=60)
+    late = stubHandler(truelayer, 'late', access_token='late.access.0', expires_at=time.time() + 90, refresh_margin=60)
+
+    early.getTransactions('2022-08-01', '2022-08-31')
+    late.getTransactions('2022-08-01', '2022-08-31')
+
+    # The token about to expire was never sent, the other is used until it enters the margin
+    assert truelayer.server.refreshes == {'early': 1}
+    assert 'early.access.0' not in truelayer.server.requests
+    assert early.access_token == 'early.access.1'
+    assert late.access_token == 'late.access.0'
+
+@pytest.mark.parametrize('rejected', [False, True])
+def test_concurrent_callers_share_one_refresh(truelayer, rejected):
+    truelayer.server.refresh_delay = 0.2
+    if rejected:
+        # The token looks valid locally, every caller gets a 401 at the same time
+        handler = stubHandler(truelayer, 'shared', access_token='shared.access.0', expires_at=time.time() + 3600)
+    else:
+        handler = stubHandler(truelayer, 'shared')
+
+    barrier = threading.Barrier(8)
+    statuses = []
+
+    def fetch():
+        barrier.wait()
+        statuses.append(handler.getTransactions('2022-08-01', '2022-08-31').json()['status'])
+
+    threads = [threading.Thread(target=fetch) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert statuses == ['Succeeded'] * 8
+    assert truelayer.server.refreshes == {'shared': 1}
+
+def test_refreshed_tokens_are_saved_to_linked_accounts(db, truelayer):
+    db.addRefreshToken('saved')
+    marshaller = DataMarshaller(db, ip='127.0.0.1', session=truelayer.session)
+
+    handler = marshaller.tlHandlers[1]
+    handler.getTransactions('2022-08-01', '2022-08-31')
+    assert db.getRefreshTokens(1)[0][1] == 'saved'
+
+    marshaller.saveTokens()
+    assert db.getRefreshTokens(1) == [(1, 'saved.refresh.1', 'saved.access.1', handler.expires_at)]
+
+    # A new session picks up the saved access token instead of refreshing again
+    DataMarshaller(db, ip='127.0.0.1', session=truelayer.session).tlHandlers[1].getTransactions('2022-08-01', '2022-08-31')
+    assert truelayer.server.refreshes == {'saved': 1}
@@ -0,0 +1,140 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from truelayer import createSession
+
+# A local TrueLayer over plain HTTP. Tokens start with their link's name so requests can be
+# told apart, e.g. refresh token "slow" becomes "slow.refresh.1" and access token "slow.access.1"
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate writes, Nagle would hold the body for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, data, status=200, body=None, content_type="application/json"):
+        body = json.dumps(data).encode() if body is None else body
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def link(self):
+        token = self.headers.get("Authorization", "").removeprefix("Bearer ")
+        with self.server.lock:
+            self.server.requests.append(token)
+            if token not in self.server.valid:
+                return None
+        return token.split('.')[0]
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b'{}')
+        path = urlparse(self.path).path
+        server = self.server
+
+        if path == "/connect/token":
+            link = payload['refresh_token'].split('.')[0]
+
+            # Held open so concurrent refreshes overlap
+            server.closing.wait(server.refresh_delay)
+            with server.lock:
+                server.refreshes[link] = n = server.refreshes.get(link, 0) + 1
+                access = f"{link}.access.{n}"
+                server.valid.add(access)
+
+            self.respond({'access_token': access, 'refresh_token': f"{link}.refresh.{n}", 'expires_in': server.expires_in})
+            return
+
+        link = self.link()
+        if link is None:
+            self.respond({'error': 'invalid_token'}, 401)
+            return
+
+        with server.lock:
+            job = len(server.jobs)
+            server.jobs.append((link, time.monotonic() + server.delays.get(link, 0)))
+        self.respond({'results_uri': f"{server.url}/results/{job}", 'status': 'Queued'}, 202)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        server = self.server
+
+        link = self.link()
+        if link is None:
+            self.respond({'error': 'invalid_token'}, 401)
+            return
+
+        server.closing.wait(server.hangs.get(link, 0))
+
+        if path.startswith("/results/"):
+            link, ready = server.jobs[int(path.rsplit('/', 1)[1])]
+            if time.monotonic() < ready:
+                self.respond({'status': 'Running'}, 202)
+                return
+
+            if link in server.failed_jobs:
+                self.respond({'status': 'Failed', 'error': server.failed_jobs[link]})
+                return
+
+            self.respond({'status': 'Succeeded', 'results': {
+                'accounts': server.accounts.get(link, []),
+                'cards': [],
+            }})
+            return
+
+        # /data/v1/accounts/{id}/transactions and /data/v1/accounts/{id}/transactions/pending
+        parts = path.split('/')
+        account_id = parts[4]
+        if account_id in server.failures:
+            status, body = server.failures[account_id]
+            self.respond(None, status, body, "text/html")
+            return
+
+        pending = parts[-1] == 'pending'
+        self.respond({'results': [] if pending else server.transactions.get(account_id, [])})
+
+class TrueLayerStub:
+    def __init__(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        self.url = self.server.url = f"http://127.0.0.1:{self.server.server_port}"
+
+        self.server.lock = threading.Lock()
+        self.server.closing = threading.Event()
+        self.server.valid = set()
+        self.server.requests = []
+        self.server.refreshes = {}
+        self.server.refresh_delay = 0
+        self.server.expires_in = 3600
+        self.server.jobs = []
+
+        # Per link: seconds until a batch job finishes, seconds every GET stalls, batch accounts,
+        # or the error a batch job fails with
+        self.server.delays = {}
+        self.server.hangs = {}
+        self.server.accounts = {}
+        self.server.failed_jobs = {}
+
+        # Per account: transactions for the per-account endpoint, or a (status, body) failure
+        self.server.transactions = {}
+        self.server.failures = {}
+
+        # The environment's proxy and CA settings don't apply to a local stub
+        self.session = createSession()
+        self.session.trust_env = False
+
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def revoke(self):
+        with self.server.lock:
+            self.server.valid.clear()
+
+    def close(self):
+        self.server.closing.set()
+        self.server.shutdown()
+        self.server.server_close()
+        self.session.close()
@@ -1,5 +1,81 @@
 import requests
+import random
+import threading
 import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+def createSession(pool_size=10, retries=3, backoff=0.3):
+    session = requests.Session()
+
+    # Only idempotent requests are retried, token and batch POSTs are not. Read timeouts
+    # aren't retried either, each retry would wait out the whole timeout again
+    retry = Retry(
+        total=retries,
+        read=False,
+        backoff_factor=backoff,
+        status_forcelist=(429, 500, 502, 503, 504),
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    return session
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+class PollTimeout(DeadlineExceeded):
+    pass
+
+class Poller:
+    def __init__(self, first_delay=0.1, factor=1.5, max_delay=2, jitter=0.2, deadline=60):
+        self.first_delay = first_delay
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.deadline = deadline
+
+        self.waited = 0
+        self.polls = 0
+
+    def delays(self):
+        delay = self.first_delay
+        while True:
+            yield delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+            delay = min(delay * self.factor, self.max_delay)
+
+    def retryAfter(self, response):
+        try:
+            return float(response.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            return None
+
+    def poll(self, request, until=None):
+        start = time.monotonic()
+        end = start + self.deadline if until is None else min(start + self.deadline, until)
+        delays = self.delays()
+        delay = next(delays)
+        polls = 0
+
+        while True:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                raise PollTimeout(f"Results still pending after {polls} polls over {end - start:.1f}s")
+
+            wait = min(delay, remaining)
+            time.sleep(wait)
+            self.waited += wait
+
+            response = request()
+            self.polls += 1
+            polls += 1
+
+            # 202 and 204 mean the job is still running
+            if response.status_code not in (202, 204):
+                return response
+
+            delay = self.retryAfter(response) or next(delays)
 
 def tlRequest(request):
     def inner(self, *args, called=1, **kwargs):
@@ -14,12 +90,9 @@ def tlRequest(request):
                 url = response.json()['results_uri']
                 return self.getResults(url)
             return response
-        
-        if response.status_code == 204:
-            return self.getResults(*args, **kwargs)
-        
+
         if response.status_code == 401:
-            self.refreshAccessToken()
+            self.refreshRejected(response)
             return tlRequest(request)(self, *args, called=called, **kwargs)
 
         return response
@@ -28,24 +101,91 @@ def tlRequest(request):
 
 
 class TrueLayerHandler:
-    def __init__(self, client_id, client_secret, redirect_uri, IP, refresh_token=None):
+    base_url = "https://api.truelayer.com"
+    auth_url = "https://auth.truelayer.com/connect/token"
+
+    def __init__(
+            self,
+            client_id,
+            client_secret,
+            redirect_uri,
+            IP,
+            refresh_token=None,
+            poller=None,
+            session=None,
+            timeout=(5, 30),
+            access_token=None,
+            expires_at=0,
+            refresh_margin=60
+        ):
         self.client_id = client_id
         self.client_secret = client_secret
         self.redirect_uri = redirect_uri
         self.ip = IP
+        self.poller = poller if poller else Poller()
+        self.session = session if session else createSession()
+        self.timeout = timeout
 
-        self.access_token = None
-        self.refresh_token = refresh_token
+        # Monotonic time the current sync of this link has to finish by, requests are cut short to fit
+        self.deadline = None
 
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.expires_at = expires_at or 0
+        self.refresh_margin = refresh_margin
+        self.tokenLock = threading.RLock()
+        self.onTokenRefresh = None
+
+    def psuIP(self):
+        return self.ip() if callable(self.ip) else self.ip
+
+    def requestTimeout(self):
+        if self.deadline is None:
+            return self.timeout
+
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded("Link deadline passed before the request was sent")
+
+        if isinstance(self.timeout, tuple):
+            return tuple(min(t, remaining) for t in self.timeout)
+        return min(self.timeout, remaining)
+
+    def tokenExpired(self):
+        return not self.access_token or time.time() > self.expires_at - self.refresh_margin
+
+    def ensureAccessToken(self):
+        if not self.refresh_token or not self.tokenExpired():
+            return
+
+        # Concurrent callers wait for the refresh already in flight instead of starting another
+        with self.tokenLock:
+            if self.tokenExpired():
+                self.refreshAccessToken()
+
+    def refreshRejected(self, response):
+        # The token is read from the rejected request before waiting on the lock, callers
+        # rejected with a token someone else already replaced just retry with the new one
+        sent = response.request.headers.get("Authorization")
+        with self.tokenLock:
+            if sent == f"Bearer {self.access_token}":
+                self.refreshAccessToken()
+
+    def storeTokens(self, response):
+        res = response.json()
+        self.access_token = res['access_token']
+        self.refresh_token = res['refresh_token']
+        self.expires_at = time.time() + res.get('expires_in', 3600)
+
+        if self.onTokenRefresh:
+            self.onTokenRefresh()
 
     def endpoint(self, type, key=None):
-        base_url = "https://api.truelayer.com"
-
         types = {
             'accounts': 'data/v1/accounts',
             'cards': 'data/v1/cards',
             'batch': 'data/v1/batch/transactions',
-            'auth': 'https://auth.truelayer.com/connect/token',
+            'auth': self.auth_url,
         }
 
         endpoints = {
@@ -59,7 +199,7 @@ class TrueLayerHandler:
         if type == 'auth':
             return types['auth']
 
-        url = f"{base_url}/{types[type]}"
+        url = f"{self.base_url}/{types[type]}"
 
         if key:
             return lambda x : f"{url}/{endpoints[key](x)}"
@@ -83,12 +223,10 @@ class TrueLayerHandler:
             "Content-Type": "application/json"
         }
 
-        response = requests.post(url, json=payload, headers=headers)
+        response = self.session.post(url, json=payload, headers=headers, timeout=self.requestTimeout())
 
         if response.status_code == 200:
-            res = response.json()
-            self.access_token = res['access_token']
-            self.refresh_token = res['refresh_token']
+            self.storeTokens(response)
 
         return response
 
@@ -107,30 +245,34 @@ class TrueLayerHandler:
             "Content-Type": "application/json"
         }
 
-        response = requests.post(url, json=payload, headers=headers)
+        response = self.session.post(url, json=payload, headers=headers, timeout=self.requestTimeout())
 
         if response.status_code == 200:
-            res = response.json()
-            self.access_token = res['access_token']
-            self.refresh_token = res['refresh_token']
+            self.storeTokens(response)
 
         return response
 
 
     def baseGetRequest(self, url):
+        self.ensureAccessToken()
         headers = {
             "Accept": "application/json",
             "X-Client-Correlation-Id": self.client_id,
-            "X-PSU-IP": self.ip,
+            "X-PSU-IP": self.psuIP(),
             "Authorization": f"Bearer {self.access_token}"
         }
 
-        return requests.get(url, headers=headers)
+        return self.session.get(url, headers=headers, timeout=self.requestTimeout())
 
-    @tlRequest
     def getResults(self, url):
-        time.sleep(2.5)
-        return self.baseGetRequest(url)
+        def request():
+            response = self.baseGetRequest(url)
+            if response.status_code == 401:
+                self.refreshRejected(response)
+                response = self.baseGetRequest(url)
+            return response
+
+        return self.poller.poll(request, until=self.deadline)
 
     @tlRequest
     def getAccounts(self):
@@ -163,6 +305,7 @@ class TrueLayerHandler:
 
     @tlRequest
     def getTransactions(self, date_from, date_to):
+        self.ensureAccessToken()
         url = self.endpoint('batch')
         
         payload = {
@@ -174,11 +317,11 @@ class TrueLayerHandler:
         headers = {
             "Accept": "application/json",
             "X-Client-Correlation-Id": self.client_id,
-            "X-PSU-IP": self.ip,
+            "X-PSU-IP": self.psuIP(),
             "Authorization": f"Bearer {self.access_token}"
         }
 
-        return requests.post(url, json=payload, headers=headers)
+        return self.session.post(url, json=payload, headers=headers, timeout=self.requestTimeout())
 
     @tlRequest
     def getAccountTransactions(